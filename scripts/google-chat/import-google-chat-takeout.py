@@ -39,18 +39,30 @@
 # Usage:
 # python3 import-google-chat-takeout.py contacts -d "Google Chat/Groups/" > contacts.json
 # python3 import-google-chat-takeout.py messages -d "Google Chat/Groups/" > messages.jsonl
+# python3 import-google-chat-takeout.py messages -d "Google Chat/Groups/" -j 8 > messages.jsonl
 
 import os
 import json
 import argparse
 import sys
-from datetime import datetime, timezone
+from datetime import timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from memento.jsonstream import get_reader
+from memento.parallel import encode_messages, imap_ordered
+from memento.timestamps import DateParser
+from memento.writer import MessageWriter
 
 PLATFORM = "google"
 
+DATE_FORMAT = "%A, %d %B %Y at %H:%M:%S"
+DATES = DateParser(DATE_FORMAT)
+
 def parse_date(date_str):
     # "Sunday, 1 March 2000 at 09:33:50 UTC"
-    dt = datetime.strptime(date_str[:-4], "%A, %d %B %Y at %H:%M:%S")
+    dt = DATES.parse(date_str[:-4])
+    if dt is None:
+        raise ValueError(f"time data {date_str[:-4]!r} does not match format {DATE_FORMAT!r}")
     return dt.astimezone(timezone.utc).replace(microsecond=0).isoformat().replace('+00:00', 'Z')
 
 def collect_contacts(directory):
@@ -75,50 +87,83 @@ def collect_contacts(directory):
                         }
     return list(contacts.values())
 
-def collect_messages(directory, on_message):
+def list_groups(directory):
     for root, _dirs, files in os.walk(directory):
         if 'messages.json' in files and 'group_info.json' in files:
-            with open(os.path.join(root, 'group_info.json'), 'r', encoding='utf-8') as f:
-                group_data = json.load(f)
-            members = group_data.get('members', [])
-            with open(os.path.join(root, 'messages.json'), 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                for msg in data.get('messages', []):
-                    creator = msg['creator']
-                    if len(members) == 2:
-                        # Direct message
-                        other = [m for m in members if m['email'] != creator['email']][0]
-                        to = {
-                            "type": "user",
-                            "user_id": str(other['email'])
-                        }
-                    else:
-                        # Group
-                        to = {
-                            "type": "group",
-                            "group_id": str(msg['topic_id'])
-                        }
-                    # if not 'text' in msg:
-                    #     raise Exception(msg)
-                    message = {
-                        "ts": parse_date(msg['created_date']),
-                        "platform": PLATFORM,
-                        "from": str(creator['email']),
-                        "to": to,
-                        "text": msg.get('text', ''),
-                        "meta": {
-                            "topic_id": msg['topic_id'],
-                        }
-                    }
-                    on_message(message)
+            yield root
+
+def iter_group_messages(f):
+    # Streams the "messages" array of a messages.json file
+    reader = get_reader(f)
+    for key in reader.object():
+        if key != 'messages':
+            reader.skip()
+            continue
+        for _ in reader.array():
+            yield reader.value()
+
+def collect_group_messages(root, on_message):
+    with open(os.path.join(root, 'group_info.json'), 'r', encoding='utf-8') as f:
+        group_data = json.load(f)
+    members = group_data.get('members', [])
+    direct = len(members) == 2
+    # Recipient email of a direct message by creator email
+    peers = {}
+    with open(os.path.join(root, 'messages.json'), 'rb') as f:
+        for msg in iter_group_messages(f):
+            creator = msg['creator']
+            if direct:
+                # Direct message
+                email = creator['email']
+                peer = peers.get(email)
+                if peer is None:
+                    other = [m for m in members if m['email'] != email][0]
+                    peer = peers[email] = str(other['email'])
+                to = {
+                    "type": "user",
+                    "user_id": peer
+                }
+            else:
+                # Group
+                to = {
+                    "type": "group",
+                    "group_id": str(msg['topic_id'])
+                }
+            # if not 'text' in msg:
+            #     raise Exception(msg)
+            message = {
+                "ts": parse_date(msg['created_date']),
+                "platform": PLATFORM,
+                "from": str(creator['email']),
+                "to": to,
+                "text": msg.get('text', ''),
+                "meta": {
+                    "topic_id": msg['topic_id'],
+                }
+            }
+            on_message(message)
+
+def collect_messages(directory, on_message):
+    for root in list_groups(directory):
+        collect_group_messages(root, on_message)
+
+def _encode_group(task):
+    # Process pool worker: imports a single group directory
+    root, backend = task
+    return encode_messages(lambda on_message: collect_group_messages(root, on_message), backend)
 
-def cb_on_message(message):
-    print(json.dumps(message, ensure_ascii=False))
+def write_messages(directory, writer, jobs=1):
+    # Imports the group directories in `jobs` processes and writes them in
+    # directory order
+    tasks = [(root, writer.backend) for root in list_groups(directory)]
+    for data, count in imap_ordered(_encode_group, tasks, jobs):
+        writer.write_encoded(data, count)
 
 def main():
     parser = argparse.ArgumentParser(description="Import Google Chat Takeout data")
     parser.add_argument('command', choices=['contacts', 'messages'])
     parser.add_argument('-d', '--directory', required=True, help='Base directory containing Google Chat/Groups/')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Import groups in N processes, 0 for one per CPU (default: 1)')
 
     args = parser.parse_args()
 
@@ -126,7 +171,11 @@ def main():
         contacts = collect_contacts(args.directory)
         json.dump(contacts, sys.stdout, indent=2)
     elif args.command == 'messages':
-        collect_messages(args.directory, cb_on_message)
+        with MessageWriter() as writer:
+            if args.jobs == 1:
+                collect_messages(args.directory, writer.write)
+            else:
+                write_messages(args.directory, writer, args.jobs)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -7,6 +7,10 @@ from xml.etree import ElementTree as ET
 from datetime import datetime
 from pathlib import Path
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from memento.parallel import encode_messages, imap_ordered
+from memento.writer import MessageWriter
+
 def format_utc_seconds(dt):
   return dt.astimezone(timezone.utc).replace(microsecond=0).isoformat().replace('+00:00', 'Z')
 
@@ -53,33 +57,31 @@ def collect_contacts(file_path):
     return contacts
 
 
-def parse_kopete_history(file_path, platform, on_message):
-    tree = ET.parse(file_path)
-    root = tree.getroot()
-
-    # Read header info
-    head = root.find("head")
-    date_node = head.find("date")
-
-    year = int(date_node.get("year"))
-    month = int(date_node.get("month"))
-
-    contacts = [c.get("contactId") for c in head.findall("contact")]
-    myself = next(c.get("contactId") for c in head.findall("contact")
-                  if c.get("type") == "myself")
-    other = next(c for c in contacts if c != myself)
-
-    messages = []
-
-    for msg in root.findall("msg"):
-        time_raw = msg.get("time")          # "20 20:9:48"
-        day_str, time_str = time_raw.split()
-
-        timestamp = datetime.strptime(
+def parse_time(year, month, time_raw):
+    # "20 20:9:48" is the day of the month and the time of day
+    day_str, time_str = time_raw.split()
+    try:
+        hour, minute, second = time_str.split(":")
+        return datetime(year, month, int(day_str), int(hour), int(minute), int(second))
+    except ValueError:
+        return datetime.strptime(
             f"{year}-{month}-{day_str} {time_str}",
             "%Y-%m-%d %H:%M:%S"
         )
 
+
+def parse_kopete_history(file_path, platform, on_message):
+    # The history is parsed incrementally and every <msg> is dropped once it
+    # has been emitted. Messages before the <head> are kept until it is read.
+    header = None
+    pending = []
+    depth = 0
+    root = None
+
+    def emit(msg):
+        year, month, myself, other = header
+        timestamp = parse_time(year, month, msg.get("time"))
+
         incoming = msg.get("in") == "1"
 
         sender = msg.get("from") if incoming else myself
@@ -94,8 +96,46 @@ def parse_kopete_history(file_path, platform, on_message):
         }
         on_message(message)
 
-
-def collect_messages(directory, on_message):
+    for event, elem in ET.iterparse(file_path, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = elem
+            depth += 1
+            continue
+        depth -= 1
+        if depth != 1:
+            continue
+
+        if elem.tag == "head" and header is None:
+            # Read header info
+            date_node = elem.find("date")
+
+            year = int(date_node.get("year"))
+            month = int(date_node.get("month"))
+
+            contacts = [c.get("contactId") for c in elem.findall("contact")]
+            myself = next(c.get("contactId") for c in elem.findall("contact")
+                          if c.get("type") == "myself")
+            other = next(c for c in contacts if c != myself)
+            header = (year, month, myself, other)
+
+            for msg in pending:
+                emit(msg)
+            pending = []
+        elif elem.tag == "msg":
+            if header is None:
+                pending.append(elem)
+                continue
+            emit(elem)
+        if header is not None:
+            root.clear()
+
+    if header is None:
+        raise ValueError(f"No <head> in {file_path}")
+
+
+def list_history_files(directory):
+  # Yields (path, platform) for every history file
   dmap = {
     "ICQProtocol": "icq",
     "JabberProtocol": "jabber",
@@ -106,16 +146,30 @@ def collect_messages(directory, on_message):
     if os.path.isdir(path):
       files = [os.path.join(dp, f) for dp, dn, filenames in os.walk(path) for f in filenames if os.path.splitext(f)[1] == '.xml']
       for file in files:
-        parse_kopete_history(file, platform, on_message)
+        yield file, platform
+
+def collect_messages(directory, on_message):
+  for file, platform in list_history_files(directory):
+    parse_kopete_history(file, platform, on_message)
+
+def _encode_history(task):
+  # Process pool worker: parses a single history file
+  file, platform, backend = task
+  return encode_messages(lambda on_message: parse_kopete_history(file, platform, on_message), backend)
 
-def cb_on_message(message):
-  print(json.dumps(message, ensure_ascii=False))
+def write_messages(directory, writer, jobs=1):
+  # Parses the history files in `jobs` processes and writes them in the same
+  # order as collect_messages
+  tasks = [(file, platform, writer.backend) for file, platform in list_history_files(directory)]
+  for data, count in imap_ordered(_encode_history, tasks, jobs):
+    writer.write_encoded(data, count)
 
 def main():
   parser = argparse.ArgumentParser(description='Import Kopete logs')
   parser.add_argument('command', choices=['contacts', 'messages'])
   parser.add_argument('-d', '--directory', help='Logs root')
   parser.add_argument('-f', '--file', help='Kopete contacts file')
+  parser.add_argument('-j', '--jobs', type=int, default=1, help='Parse history files in N processes, 0 for one per CPU (default: 1)')
 
   args = parser.parse_args()
 
@@ -123,7 +177,11 @@ def main():
     contacts = collect_contacts(args.file)
     json.dump(contacts, sys.stdout, indent=2, ensure_ascii=False)
   elif args.command == 'messages':
-    collect_messages(args.directory, cb_on_message)
+    with MessageWriter() as writer:
+      if args.jobs == 1:
+        collect_messages(args.directory, writer.write)
+      else:
+        write_messages(args.directory, writer, args.jobs)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,7 @@
+# Shared helpers for the importer scripts.
+#
+# The scripts live in per-platform directories and are run directly, so they
+# put the parent `scripts/` directory on `sys.path` before importing from here:
+#
+#   sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+#   from memento.writer import MessageWriter
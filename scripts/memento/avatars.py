@@ -0,0 +1,135 @@
+# Content addressed avatar store for the contact importers.
+#
+# Images are saved once under the hash of their content, so the same default
+# avatar shared by hundreds of contacts takes a single file. index.json in
+# the avatar directory maps every user to the URL it was fetched from and
+# the stored file name, a re-run only downloads users whose URL changed.
+#
+# Downloads go through a bounded thread pool sharing one pooled requests
+# session with timeouts and retries.
+#
+# Usage:
+#   store = AvatarStore(avatar_dir)
+#   files = fetch_avatars([(user_id, url), ...], store)
+#   store.save()
+
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+INDEX_FILE = 'index.json'
+DOWNLOAD_WORKERS = 8
+TIMEOUT = (5, 30)
+RETRIES = 3
+
+# Magic numbers of the image formats served as avatars
+IMAGE_TYPES = (
+  (b'\xff\xd8\xff', '.jpg'),
+  (b'\x89PNG\r\n\x1a\n', '.png'),
+  (b'GIF87a', '.gif'),
+  (b'GIF89a', '.gif'),
+)
+
+
+def image_extension(data):
+  for magic, ext in IMAGE_TYPES:
+    if data.startswith(magic):
+      return ext
+  if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+    return '.webp'
+  return '.jpg'
+
+
+class AvatarStore:
+
+  def __init__(self, directory):
+    self.directory = directory
+    self.index_path = os.path.join(directory, INDEX_FILE)
+    os.makedirs(directory, exist_ok=True)
+    try:
+      with open(self.index_path, 'r', encoding='utf-8') as f:
+        self.index = json.load(f)
+    except FileNotFoundError:
+      self.index = {}
+
+  def get(self, user_id, url):
+    # Returns the stored file name if the avatar of user_id was already
+    # fetched from url
+    entry = self.index.get(user_id)
+    if entry is None or entry['url'] != url:
+      return None
+    if not os.path.exists(os.path.join(self.directory, entry['file'])):
+      return None
+    return entry['file']
+
+  def put(self, user_id, url, data):
+    name = hashlib.sha256(data).hexdigest() + image_extension(data)
+    path = os.path.join(self.directory, name)
+    if not os.path.exists(path):
+      tmp = path + '.tmp'
+      with open(tmp, 'wb') as f:
+        f.write(data)
+      os.replace(tmp, path)
+    self.index[user_id] = {'url': url, 'file': name}
+    return name
+
+  def save(self):
+    tmp = self.index_path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+      json.dump(self.index, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, self.index_path)
+
+
+def make_session(pool_size=DOWNLOAD_WORKERS, retries=RETRIES):
+  # A requests session with a connection pool large enough for every worker
+  # and retries with backoff on connection errors and 429/5xx responses
+  import requests
+  from requests.adapters import HTTPAdapter
+  from urllib3.util.retry import Retry
+
+  retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504),
+                allowed_methods=frozenset(['GET']))
+  adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+  session = requests.Session()
+  session.mount('http://', adapter)
+  session.mount('https://', adapter)
+  return session
+
+
+def fetch_avatars(avatars, store, session=None, workers=DOWNLOAD_WORKERS, timeout=TIMEOUT):
+  # Fetches the (user_id, url) pairs missing from the store and returns a
+  # dict of user_id to stored file name, None for failed downloads. Every
+  # distinct URL is requested once.
+  files = {}
+  missing = {}
+  for user_id, url in avatars:
+    name = store.get(user_id, url)
+    if name is not None:
+      files[user_id] = name
+    else:
+      missing.setdefault(url, []).append(user_id)
+  if not missing:
+    return files
+
+  if session is None:
+    session = make_session(workers)
+
+  def download(url):
+    try:
+      response = session.get(url, timeout=timeout)
+      response.raise_for_status()
+      return response.content, None
+    except Exception as e:
+      return None, e
+
+  with ThreadPoolExecutor(max_workers=workers) as executor:
+    for (url, user_ids), (data, error) in zip(missing.items(), executor.map(download, missing)):
+      for user_id in user_ids:
+        if error is not None:
+          print(f"Failed to download avatar for {user_id}: {error}", file=sys.stderr)
+          files[user_id] = None
+        else:
+          files[user_id] = store.put(user_id, url, data)
+  return files
@@ -0,0 +1,97 @@
+# Parallel processing of large JSONL files in newline aligned byte ranges.
+#
+# The file is split into ranges that each end just after a newline, so every
+# range holds whole lines. Workers map the file with mmap, copy out their own
+# range and run a function over it; results come back in file order and can
+# be reduced in the parent.
+#
+# Usage:
+#   def count_platforms(chunk):
+#     counts = Counter()
+#     for _offset, line in chunk.lines():
+#       counts[json.loads(line)['platform']] += 1
+#     return counts
+#
+#   total = reduce_chunks('messages.jsonl', count_platforms, operator.add, Counter(), jobs=0)
+#
+# The worker function must be defined at module level so it can be sent to
+# the pool.
+
+import mmap
+import os
+
+from .parallel import imap_ordered, job_count
+
+MIN_CHUNK_SIZE = 1 << 20
+MAX_CHUNK_SIZE = 64 << 20
+CHUNKS_PER_JOB = 4
+
+
+class Chunk:
+  # A range of whole lines starting at byte `start` of the file
+
+  def __init__(self, data, start):
+    self.data = data
+    self.start = start
+
+  def lines(self):
+    # Yields (byte offset in the file, line) for every line, without the
+    # newline
+    lines = self.data.split(b'\n')
+    if not lines[-1]:
+      lines.pop()
+    offset = self.start
+    for line in lines:
+      yield offset, line
+      offset += len(line) + 1
+
+
+def chunk_size_for(size, jobs=1):
+  # Enough ranges to keep every job busy while bounding worker memory
+  size = size // (job_count(jobs) * CHUNKS_PER_JOB)
+  return min(MAX_CHUNK_SIZE, max(MIN_CHUNK_SIZE, size))
+
+
+def split_ranges(path, chunk_size=MAX_CHUNK_SIZE):
+  # Returns (start, end) byte ranges covering the file, every range but the
+  # last ends just after a newline. A line longer than chunk_size makes its
+  # range longer.
+  size = os.path.getsize(path)
+  if size == 0:
+    return []
+  ranges = []
+  with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+    start = 0
+    while start < size:
+      end = start + chunk_size
+      if end >= size:
+        end = size
+      else:
+        newline = m.find(b'\n', end - 1)
+        end = size if newline < 0 else newline + 1
+      ranges.append((start, end))
+      start = end
+  return ranges
+
+
+def _run_chunk(task):
+  func, path, start, end, args = task
+  with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+    data = m[start:end]
+  return func(Chunk(data, start), *args)
+
+
+def map_chunks(path, func, jobs=1, chunk_size=None, args=()):
+  # Yields func(chunk, *args) for every range of the file, in file order
+  if chunk_size is None:
+    chunk_size = chunk_size_for(os.path.getsize(path), jobs)
+  tasks = [(func, path, start, end, args) for start, end in split_ranges(path, chunk_size)]
+  return imap_ordered(_run_chunk, tasks, jobs)
+
+
+def reduce_chunks(path, func, reduce, initial, jobs=1, chunk_size=None, args=()):
+  # Folds the results of map_chunks in file order with reduce(acc, result)
+  result = initial
+  for chunk_result in map_chunks(path, func, jobs, chunk_size, args):
+    result = reduce(result, chunk_result)
+  return result
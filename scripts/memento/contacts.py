@@ -0,0 +1,46 @@
+# Contact set collected while importing, shaped like []ty.Contact.
+
+import json
+
+
+def contact(id, platform, name):
+  return {
+    'name': name,
+    'platforms': [{
+      'id': id,
+      'platform': platform,
+      'name': name,
+      'avatar': '',
+      'meta': {}
+    }]
+  }
+
+
+class ContactCollector:
+  # Keeps the first contact seen for every key, in insertion order
+
+  def __init__(self):
+    self.contacts = {}
+
+  def __contains__(self, key):
+    return key in self.contacts
+
+  def __len__(self):
+    return len(self.contacts)
+
+  def add(self, key, id, platform, name):
+    if key not in self.contacts:
+      self.contacts[key] = contact(id, platform, name)
+
+  def update(self, contacts):
+    # Merges a {key: contact} mapping, e.g. collected in a worker process
+    for key, value in contacts.items():
+      if key not in self.contacts:
+        self.contacts[key] = value
+
+  def values(self):
+    return list(self.contacts.values())
+
+  def dump(self, path):
+    with open(path, 'w', encoding='utf-8') as f:
+      json.dump(self.values(), f, indent=2, ensure_ascii=False)
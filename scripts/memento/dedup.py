@@ -0,0 +1,156 @@
+# Streaming duplicate elimination for ty.Message JSONL.
+#
+# Messages are fingerprinted on (platform, from, to, ts, text), with `ts`
+# normalized to POSIX time so the same instant written differently by two
+# importers still matches. Fingerprints are kept either in a packed exact set
+# of 128 bit digests or in a fixed size Bloom filter that bounds memory at the
+# cost of occasionally dropping a unique message.
+
+import hashlib
+import math
+from array import array
+
+from .timestamps import parse_rfc3339
+
+
+def fingerprint(message):
+  # Returns a 128 bit digest of the identifying fields of a message
+  to = message.get('to') or {}
+  target = to.get('user_id') if to.get('type') == 'user' else to.get('group_id')
+  key = '\0'.join((
+    str(message.get('platform') or ''),
+    str(message.get('from') or ''),
+    str(to.get('type') or ''),
+    str(target or ''),
+    repr(parse_rfc3339(message['ts'])),
+    str(message.get('text') or ''),
+  ))
+  return hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+
+
+class ExactSet:
+  # Open addressing hash table of digests packed into two arrays of 64 bit
+  # halves, with linear probing. The table doubles when it is 3/4 full, so it
+  # takes 21 to 43 bytes per digest. A slot with both halves zero is empty,
+  # the all zero digest itself is tracked separately.
+
+  MIN_SLOTS = 1 << 16
+  MAX_LOAD = 0.75
+
+  def __init__(self):
+    self._allocate(self.MIN_SLOTS)
+    self.count = 0
+    self._zero = False
+
+  def _allocate(self, slots):
+    self.mask = slots - 1
+    self.low = array('Q', bytes(slots * 8))
+    self.high = array('Q', bytes(slots * 8))
+    self.limit = int(slots * self.MAX_LOAD)
+
+  def __len__(self):
+    return self.count
+
+  def _insert(self, low, high):
+    # Returns True if the digest was already in the table
+    lows = self.low
+    highs = self.high
+    mask = self.mask
+    slot = low & mask
+    while True:
+      stored = lows[slot]
+      if stored == low:
+        if highs[slot] == high:
+          return True
+      elif not stored and not highs[slot]:
+        lows[slot] = low
+        highs[slot] = high
+        return False
+      slot = (slot + 1) & mask
+
+  def _grow(self):
+    lows, highs = self.low, self.high
+    self._allocate((self.mask + 1) * 2)
+    insert = self._insert
+    for low, high in zip(lows, highs):
+      if low or high:
+        insert(low, high)
+
+  def add(self, digest):
+    # Adds a digest, returns True if it was already present
+    low = int.from_bytes(digest[:8], 'little')
+    high = int.from_bytes(digest[8:], 'little')
+    if not low and not high:
+      present, self._zero = self._zero, True
+    else:
+      present = self._insert(low, high)
+    if not present:
+      self.count += 1
+      if self.count > self.limit:
+        self._grow()
+    return present
+
+
+class BloomFilter:
+  def __init__(self, capacity, error_rate=0.001):
+    self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+    self.hashes = max(1, round(self.size / capacity * math.log(2)))
+    self.bits = bytearray((self.size + 7) // 8)
+    self.count = 0
+
+  def __len__(self):
+    return self.count
+
+  def add(self, digest):
+    # Adds a digest, returns True if it was (probably) already present.
+    # The k bit positions are derived from the two 64 bit halves of the
+    # digest with double hashing.
+    h1 = int.from_bytes(digest[:8], 'little')
+    h2 = int.from_bytes(digest[8:], 'little') | 1
+    bits = self.bits
+    present = True
+    for i in range(self.hashes):
+      pos = (h1 + i * h2) % self.size
+      mask = 1 << (pos & 7)
+      if not bits[pos >> 3] & mask:
+        bits[pos >> 3] |= mask
+        present = False
+    if not present:
+      self.count += 1
+    return present
+
+
+class DedupStats:
+  def __init__(self):
+    self.read = 0
+    self.written = 0
+    self.dropped = {}
+
+  @property
+  def dropped_total(self):
+    return sum(self.dropped.values())
+
+
+def dedup_lines(lines, writer, seen, loads):
+  # Copies JSONL lines to writer, skipping messages already in `seen`.
+  # `lines` yields (path, line number, line). Returns DedupStats with dropped
+  # counts per platform.
+  stats = DedupStats()
+  for path, n, line in lines:
+    if not line.strip():
+      continue
+    stats.read += 1
+    try:
+      message = loads(line)
+      digest = fingerprint(message)
+    except Exception as e:
+      raise ValueError(f"{path}:{n}: cannot fingerprint message: {e}") from e
+    if seen.add(digest):
+      platform = message.get('platform') or ''
+      stats.dropped[platform] = stats.dropped.get(platform, 0) + 1
+      continue
+    if not line.endswith(b'\n'):
+      line += b'\n'
+    writer.write_encoded(line)
+    stats.written += 1
+  return stats
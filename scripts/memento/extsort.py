@@ -0,0 +1,103 @@
+# Bounded memory external sort of ty.Message JSONL files by timestamp.
+#
+# Input lines are collected into runs of at most `buffer_size` bytes, each run
+# is sorted in memory and spilled to a temporary file, and the runs are then
+# merged with a k-way heap merge. Lines are copied through unchanged and the
+# sort is stable: messages with the same timestamp keep their input order.
+
+import heapq
+import os
+import struct
+import tempfile
+from operator import itemgetter
+
+from .timestamps import parse_rfc3339
+from .writer import BUFFER_SIZE, get_loads
+
+BUFFER_SIZE_RUN = 256 << 20
+MAX_FANIN = 256
+# Read buffer of every run being merged, bounds merge memory to MAX_FANIN times this
+RUN_READ_SIZE = 64 << 10
+
+# Run files store (timestamp, line length) followed by the line
+_RECORD = struct.Struct('<dI')
+
+
+def _read_lines(inputs, loads):
+  # Yields (timestamp, line) for every non-empty line of the inputs
+  for path in inputs:
+    with open(path, 'rb', buffering=BUFFER_SIZE) as f:
+      for n, line in enumerate(f, 1):
+        if not line.strip():
+          continue
+        if not line.endswith(b'\n'):
+          line += b'\n'
+        try:
+          ts = parse_rfc3339(loads(line)['ts'])
+        except Exception as e:
+          raise ValueError(f"{path}:{n}: cannot read message timestamp: {e}") from e
+        yield ts, line
+
+
+def spill_run(run, directory):
+  # Writes a sorted list of (timestamp, line) pairs to a new run file in
+  # directory and returns its path
+  fd, path = tempfile.mkstemp(suffix='.run', dir=directory)
+  with os.fdopen(fd, 'wb', buffering=BUFFER_SIZE) as f:
+    for ts, line in run:
+      f.write(_RECORD.pack(ts, len(line)))
+      f.write(line)
+  return path
+
+
+def _read_run(path):
+  with open(path, 'rb', buffering=RUN_READ_SIZE) as f:
+    while True:
+      head = f.read(_RECORD.size)
+      if not head:
+        break
+      ts, size = _RECORD.unpack(head)
+      yield ts, f.read(size)
+  os.remove(path)
+
+
+def _merge(runs):
+  return heapq.merge(*runs, key=itemgetter(0))
+
+
+def merge_runs(paths, directory, run=()):
+  # Yields the (timestamp, line) pairs of the run files merged by timestamp,
+  # followed in input order by the in-memory `run`. Run files are removed as
+  # they are read. Runs are first merged in groups until they can be merged
+  # in one pass.
+  while len(paths) > MAX_FANIN:
+    merged = []
+    for i in range(0, len(paths), MAX_FANIN):
+      group = paths[i:i + MAX_FANIN]
+      merged.append(group[0] if len(group) == 1 else spill_run(_merge([_read_run(p) for p in group]), directory))
+    paths = merged
+  return _merge([_read_run(p) for p in paths] + [run])
+
+
+def sort_messages(inputs, writer, buffer_size=BUFFER_SIZE_RUN, temp_dir=None):
+  # Sorts the messages of all input files by timestamp into writer.
+  # Returns the number of runs that were spilled to disk.
+  _name, loads = get_loads()
+  with tempfile.TemporaryDirectory(prefix='memento-sort-', dir=temp_dir) as directory:
+    runs = []
+    run = []
+    size = 0
+    for item in _read_lines(inputs, loads):
+      run.append(item)
+      size += len(item[1])
+      if size >= buffer_size:
+        run.sort(key=itemgetter(0))
+        runs.append(spill_run(run, directory))
+        run = []
+        size = 0
+    run.sort(key=itemgetter(0))
+
+    # The last run is still in memory and comes after the spilled ones in input order
+    for _ts, line in merge_runs(runs, directory, run):
+      writer.write_encoded(line)
+  return len(runs)
@@ -0,0 +1,192 @@
+# Incremental reader for JSON documents too large to load at once.
+#
+# The reader walks the document from the top: `object()` yields the keys of
+# the object at the current position and `array()` yields once per element,
+# and for each of them the caller consumes the value with `value()`,
+# `skip()` or another `object()`/`array()`. Only the values that are
+# actually decoded are held in memory.
+#
+# ijson is used when it is installed, otherwise a pure Python reader decodes
+# every value with json.JSONDecoder.raw_decode over a sliding buffer.
+#
+# Usage:
+#   reader = get_reader(fp)
+#   for key in reader.object():
+#     if key == 'conversations':
+#       for _ in reader.array():
+#         handle(reader.value())
+#     else:
+#       reader.skip()
+
+import io
+import json
+import re
+
+CHUNK_SIZE = 1 << 16
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_NUMBER_TAIL = re.compile(r'[0-9.eE+-]*\Z')
+
+
+class PythonReader:
+  backend = 'python'
+
+  def __init__(self, fp, chunk_size=CHUNK_SIZE, encoding='utf-8'):
+    if isinstance(fp, io.TextIOBase):
+      self.fp = fp
+    else:
+      self.fp = io.TextIOWrapper(fp, encoding=encoding)
+    self.chunk_size = chunk_size
+    self.decoder = json.JSONDecoder()
+    self.buf = ''
+    self.pos = 0
+
+  def _read(self):
+    # Appends the next chunk to the unconsumed part of the buffer. Reads at
+    # least as much as is buffered so a value spanning many chunks is only
+    # re-decoded a logarithmic number of times.
+    chunk = self.fp.read(max(self.chunk_size, len(self.buf) - self.pos))
+    if not chunk:
+      return False
+    self.buf = self.buf[self.pos:] + chunk
+    self.pos = 0
+    return True
+
+  def _peek(self):
+    # Returns the next non-whitespace character, '' at the end of input
+    while True:
+      self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+      if self.pos < len(self.buf):
+        return self.buf[self.pos]
+      if not self._read():
+        return ''
+
+  def _expect(self, char):
+    found = self._peek()
+    if found != char:
+      raise ValueError(f"Expected {char!r} but found {found!r}")
+    self.pos += 1
+
+  def value(self):
+    self._peek()
+    while True:
+      try:
+        value, end = self.decoder.raw_decode(self.buf, self.pos)
+      except json.JSONDecodeError:
+        if not self._read():
+          raise
+        continue
+      # A number at the end of the buffer may continue in the next chunk
+      if _NUMBER_TAIL.match(self.buf, end) and self._read():
+        continue
+      self.pos = end
+      return value
+
+  skip = value
+
+  def object(self):
+    self._expect('{')
+    if self._peek() == '}':
+      self.pos += 1
+      return
+    while True:
+      key = self.value()
+      if not isinstance(key, str):
+        raise ValueError(f"Expected an object key but found {key!r}")
+      self._expect(':')
+      yield key
+      char = self._peek()
+      self.pos += 1
+      if char == '}':
+        return
+      if char != ',':
+        raise ValueError(f"Expected ',' or '}}' but found {char!r}")
+
+  def array(self):
+    self._expect('[')
+    if self._peek() == ']':
+      self.pos += 1
+      return
+    index = 0
+    while True:
+      yield index
+      index += 1
+      char = self._peek()
+      self.pos += 1
+      if char == ']':
+        return
+      if char != ',':
+        raise ValueError(f"Expected ',' or ']' but found {char!r}")
+
+
+class IjsonReader:
+  backend = 'ijson'
+
+  def __init__(self, fp):
+    import ijson
+    self.builder = ijson.ObjectBuilder
+    self.events = ijson.basic_parse(fp, use_float=True)
+    self.pending = None
+
+  def _next(self):
+    if self.pending is not None:
+      event, self.pending = self.pending, None
+      return event
+    return next(self.events)
+
+  def _expect(self, expected):
+    event, value = self._next()
+    if event != expected:
+      raise ValueError(f"Expected {expected} but found {event}")
+
+  def value(self):
+    event, value = self._next()
+    if event not in ('start_map', 'start_array'):
+      return value
+    builder = self.builder()
+    builder.event(event, value)
+    depth = 1
+    while depth:
+      event, value = self._next()
+      if event in ('start_map', 'start_array'):
+        depth += 1
+      elif event in ('end_map', 'end_array'):
+        depth -= 1
+      builder.event(event, value)
+    return builder.value
+
+  skip = value
+
+  def object(self):
+    self._expect('start_map')
+    while True:
+      event, value = self._next()
+      if event == 'end_map':
+        return
+      yield value
+
+  def array(self):
+    self._expect('start_array')
+    index = 0
+    while True:
+      event = self._next()
+      if event[0] == 'end_array':
+        return
+      self.pending = event
+      yield index
+      index += 1
+
+
+def get_reader(fp, backend=None):
+  # Returns a reader over the binary file `fp`, backend is 'ijson' or
+  # 'python'. By default ijson is used when it is installed.
+  if backend == 'python':
+    return PythonReader(fp)
+  if backend == 'ijson':
+    return IjsonReader(fp)
+  if backend is not None:
+    raise ValueError(f"Unknown JSON stream backend: {backend}")
+  try:
+    return IjsonReader(fp)
+  except ImportError:
+    return PythonReader(fp)
@@ -0,0 +1,73 @@
+# Per-file offset manifest for incremental imports of append-only exports.
+#
+# The manifest is a JSON file mapping every input file, relative to the
+# export directory, to its size, mtime and the byte offset up to which it has
+# been imported:
+#
+# {
+#   "chats/alice.jsonl": {"size": 1024, "mtime": 1700000000000000000, "offset": 1024}
+# }
+
+import json
+import os
+
+
+class Manifest:
+  def __init__(self, path, directory):
+    self.path = path
+    self.directory = directory
+    self.files = {}
+    if os.path.exists(path):
+      with open(path, 'r', encoding='utf-8') as f:
+        self.files = json.load(f)
+
+  def _key(self, path):
+    return os.path.relpath(path, self.directory)
+
+  def pending(self, path):
+    # Returns (offset, stat) to resume reading path from, or None when the
+    # file has not changed since the last import
+    st = os.stat(path)
+    entry = self.files.get(self._key(path))
+    if entry is None:
+      return 0, st
+    if entry['size'] == st.st_size and entry['mtime'] == st.st_mtime_ns:
+      return None
+    if st.st_size < entry['offset']:
+      # truncated or replaced, start over
+      return 0, st
+    return entry['offset'], st
+
+  def update(self, path, st, offset):
+    self.files[self._key(path)] = {
+      'size': st.st_size,
+      'mtime': st.st_mtime_ns,
+      'offset': offset,
+    }
+
+  def save(self):
+    tmp = self.path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+      json.dump(self.files, f, indent=2, sort_keys=True)
+    os.replace(tmp, self.path)
+
+
+class AppendedLines:
+  # Iterates the complete lines of a file starting at a byte offset. A
+  # trailing line without a newline is left for the next run, as the
+  # exporter may still be writing it. `offset` is the end of the last line
+  # yielded.
+
+  def __init__(self, path, offset=0, encoding='utf-8'):
+    self.path = path
+    self.offset = offset
+    self.encoding = encoding
+
+  def __iter__(self):
+    with open(self.path, 'rb') as fh:
+      fh.seek(self.offset)
+      for raw in fh:
+        if not raw.endswith(b'\n'):
+          break
+        self.offset += len(raw)
+        yield raw.decode(self.encoding, errors='ignore')
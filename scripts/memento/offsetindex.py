@@ -0,0 +1,299 @@
+# Byte offset sidecar index of a messages.jsonl archive.
+#
+# `memento serve` answers /api/messages by scanning the archive from the
+# first line. The index lets a reader seek straight to the records of a page
+# instead:
+#
+# - every user has a sorted array of (timestamp, byte offset) of the messages
+#   sent by or to them, matching the contact_id filter of the server, and
+#   every group has one of the messages sent to it. Users and groups share
+#   the key table and the entry columns, so a page of any contact is a binary
+#   search in one array and one read per record.
+# - a coarse table maps the first line starting in every block of the
+#   archive to the highest timestamp of the lines before it, so a cursor
+#   without a contact can skip every block that cannot hold a later message.
+#
+# Timestamps are nanoseconds since the epoch, as in Go's time.Time. The
+# archive is expected to be sorted by timestamp (tools/sort-messages.py),
+# then the entries of every contact are in file order as well.
+#
+# Layout, little endian, every section 8 byte aligned:
+#
+#   header    HEADER
+#   keys      KEY per contact, sorted by (kind, id)
+#   ids       UTF-8 contact ids referenced by the keys, zero padded
+#   entries   int64 timestamps of every key's entries, then their offsets
+#   blocks    int64 highest earlier timestamps, then the block offsets
+#
+# The header records the size and mtime of the archive, `MessageIndex.stale`
+# tells whether the archive changed since the index was built.
+#
+# Usage:
+#   build_index('messages.jsonl', index_path('messages.jsonl'), jobs=0)
+#
+#   with MessageIndex(index_path('messages.jsonl')) as index:
+#     offsets = index.find(KIND_USER, 'alice', after=rfc3339_nanos(cursor), limit=100)
+
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_right
+
+from .chunked import map_chunks
+from .timestamps import rfc3339_nanos
+from .writer import get_loads
+
+MAGIC = b'MJIX'
+VERSION = 1
+FLAG_SORTED = 1
+
+BLOCK_SIZE = 1 << 20
+MIN_TS = -(1 << 63)
+
+KIND_USER = 0
+KIND_GROUP = 1
+
+# magic, version, flags, archive size, archive mtime (ns), messages,
+# block size, keys, size of the ids section, entries, blocks
+HEADER = struct.Struct('<4sHHQqQQQQQQ')
+# kind, id length, id offset in the ids section, first entry, entry count
+KEY = struct.Struct('<B3xIQQQ')
+
+
+def index_path(path):
+  return path + '.idx'
+
+
+def _column(values):
+  if sys.byteorder != 'little':
+    values = array('q', values)
+    values.byteswap()
+  return values.tobytes()
+
+
+def _pad(f, size):
+  if size % 8:
+    f.write(bytes(8 - size % 8))
+
+
+class IndexBuilder:
+  # Entries of a range of whole lines of the archive, in file order. Results
+  # of consecutive ranges are combined with merge.
+
+  def __init__(self, block_size=BLOCK_SIZE):
+    self.block_size = block_size
+    self.messages = 0
+    self.users = {}
+    self.groups = {}
+    self.block_ts = array('q')
+    self.block_offsets = array('q')
+    self.first_ts = None
+    self.last_ts = MIN_TS
+    self.max_ts = MIN_TS
+    self.ordered = True
+    self._block = None
+
+  def _append(self, keys, key, ts, offset):
+    entries = keys.get(key)
+    if entries is None:
+      entries = keys[key] = (array('q'), array('q'))
+    entries[0].append(ts)
+    entries[1].append(offset)
+
+  def add(self, offset, m):
+    ts = rfc3339_nanos(m['ts'])
+    block = offset // self.block_size
+    if block != self._block:
+      self._block = block
+      self.block_ts.append(self.max_ts)
+      self.block_offsets.append(offset)
+
+    frm = m['from']
+    self._append(self.users, frm, ts, offset)
+    to = m['to']
+    if to['type'] == 'user':
+      if to['user_id'] != frm:
+        self._append(self.users, to['user_id'], ts, offset)
+    else:
+      self._append(self.groups, to['group_id'], ts, offset)
+
+    if self.first_ts is None:
+      self.first_ts = ts
+    if ts < self.last_ts:
+      self.ordered = False
+    self.last_ts = ts
+    if ts > self.max_ts:
+      self.max_ts = ts
+    self.messages += 1
+
+  def merge(self, other):
+    # Appends the entries of the lines that follow the ones of this builder
+    if not other.messages:
+      return self
+    if other.first_ts < self.last_ts:
+      self.ordered = False
+    self.ordered = self.ordered and other.ordered
+    for keys, other_keys in ((self.users, other.users), (self.groups, other.groups)):
+      for key, (ts, offsets) in other_keys.items():
+        entries = keys.get(key)
+        if entries is None:
+          keys[key] = (ts, offsets)
+        else:
+          entries[0].extend(ts)
+          entries[1].extend(offsets)
+    # The first line of the other range only starts a block if none of the
+    # lines of this range is in the same block
+    skip = 0
+    if self.block_offsets and (self.block_offsets[-1] // self.block_size
+                               == other.block_offsets[0] // self.block_size):
+      skip = 1
+    self.block_ts.extend(max(self.max_ts, ts) for ts in other.block_ts[skip:])
+    self.block_offsets.extend(other.block_offsets[skip:])
+    if self.first_ts is None:
+      self.first_ts = other.first_ts
+    self.last_ts = other.last_ts
+    self.max_ts = max(self.max_ts, other.max_ts)
+    self.messages += other.messages
+    return self
+
+  def _keys(self):
+    # Yields (kind, id, timestamps, offsets) in index order, entries sorted
+    # by timestamp and offset
+    keys = [(KIND_USER, key.encode('utf-8'), entries) for key, entries in self.users.items()]
+    keys += [(KIND_GROUP, key.encode('utf-8'), entries) for key, entries in self.groups.items()]
+    keys.sort(key=lambda key: key[:2])
+    for kind, key, (ts, offsets) in keys:
+      if not self.ordered:
+        # Offsets grow in file order, so a stable sort by timestamp keeps
+        # equal timestamps ordered by offset
+        order = sorted(range(len(ts)), key=ts.__getitem__)
+        ts = array('q', [ts[i] for i in order])
+        offsets = array('q', [offsets[i] for i in order])
+      yield kind, key, ts, offsets
+
+  def write(self, path, archive_size=0, archive_mtime=0):
+    # Writes the index atomically
+    keys = list(self._keys())
+    ids_size = sum(len(key) for _kind, key, _ts, _offsets in keys)
+    entry_count = sum(len(ts) for _kind, _key, ts, _offsets in keys)
+    flags = FLAG_SORTED if self.ordered else 0
+
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+      f.write(HEADER.pack(MAGIC, VERSION, flags, archive_size, archive_mtime, self.messages,
+                          self.block_size, len(keys), ids_size, entry_count, len(self.block_ts)))
+      id_offset = 0
+      first = 0
+      for kind, key, ts, _offsets in keys:
+        f.write(KEY.pack(kind, len(key), id_offset, first, len(ts)))
+        id_offset += len(key)
+        first += len(ts)
+      for _kind, key, _ts, _offsets in keys:
+        f.write(key)
+      _pad(f, ids_size)
+      for _kind, _key, ts, _offsets in keys:
+        f.write(_column(ts))
+      for _kind, _key, _ts, offsets in keys:
+        f.write(_column(offsets))
+      f.write(_column(self.block_ts))
+      f.write(_column(self.block_offsets))
+    os.replace(tmp, path)
+
+
+def index_chunk(chunk, block_size=BLOCK_SIZE):
+  # memento.chunked worker
+  _name, loads = get_loads()
+  builder = IndexBuilder(block_size)
+  for offset, line in chunk.lines():
+    try:
+      builder.add(offset, loads(line))
+    except Exception as e:
+      raise ValueError(f"offset {offset}: cannot index message: {e!r}") from e
+  return builder
+
+
+def build_index(path, output=None, jobs=1, block_size=BLOCK_SIZE):
+  # Indexes the archive at path, by default into index_path(path), and
+  # returns the builder
+  stat = os.stat(path)
+  builder = IndexBuilder(block_size)
+  for chunk_builder in map_chunks(path, index_chunk, jobs, args=(block_size,)):
+    builder.merge(chunk_builder)
+  builder.write(output or index_path(path), stat.st_size, stat.st_mtime_ns)
+  return builder
+
+
+class MessageIndex:
+  # Read only view of an index file
+
+  def __init__(self, path):
+    with open(path, 'rb') as f:
+      self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    (magic, version, self.flags, self.archive_size, self.archive_mtime, self.messages,
+     self.block_size, key_count, ids_size, entry_count, block_count) = HEADER.unpack_from(self._mmap)
+    if magic != MAGIC:
+      raise ValueError(f"{path}: not a messages index")
+    if version != VERSION:
+      raise ValueError(f"{path}: unsupported index version {version}")
+
+    view = memoryview(self._mmap)
+    pos = HEADER.size
+    ids_pos = pos + key_count * KEY.size
+    self.keys = {}
+    for kind, length, id_offset, first, count in KEY.iter_unpack(view[pos:ids_pos]):
+      key = bytes(view[ids_pos + id_offset:ids_pos + id_offset + length]).decode('utf-8')
+      self.keys[kind, key] = (first, first + count)
+    pos = ids_pos + ids_size + (-ids_size % 8)
+
+    def column(count):
+      nonlocal pos
+      values = view[pos:pos + count * 8].cast('q')
+      pos += count * 8
+      if sys.byteorder != 'little':
+        values = array('q', values)
+        values.byteswap()
+      return values
+
+    self._ts = column(entry_count)
+    self._offsets = column(entry_count)
+    self._block_ts = column(block_count)
+    self._block_offsets = column(block_count)
+
+  @property
+  def sorted(self):
+    return bool(self.flags & FLAG_SORTED)
+
+  def stale(self, path):
+    # True if the archive at path is not the one the index was built from
+    stat = os.stat(path)
+    return stat.st_size != self.archive_size or stat.st_mtime_ns != self.archive_mtime
+
+  def find(self, kind, key, after=None, limit=None):
+    # Returns the offsets of the messages of a user or group, ordered by
+    # timestamp, optionally only those later than `after` nanoseconds
+    first, end = self.keys.get((kind, key), (0, 0))
+    if after is not None:
+      first = bisect_right(self._ts, after, first, end)
+    if limit is not None:
+      end = min(end, first + limit)
+    return self._offsets[first:end].tolist()
+
+  def seek(self, after):
+    # Returns the offset to scan from for the messages later than `after`
+    # nanoseconds, every line before it has an earlier or equal timestamp
+    block = bisect_right(self._block_ts, after) - 1
+    if block < 0:
+      return 0
+    return self._block_offsets[block]
+
+  def close(self):
+    self._ts = self._offsets = self._block_ts = self._block_offsets = None
+    self._mmap.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
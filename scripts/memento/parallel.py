@@ -0,0 +1,61 @@
+# Ordered process pool helpers for the importer scripts.
+#
+# Importers parse independent files in worker processes and hand the encoded
+# output back to a single MessageWriter in the parent, so the result does not
+# depend on the number of jobs.
+
+import io
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from operator import itemgetter
+
+from .timestamps import parse_rfc3339
+from .writer import MessageWriter
+
+
+def job_count(jobs):
+  # 0 or a negative value means one job per CPU
+  if jobs is None or jobs <= 0:
+    return os.cpu_count() or 1
+  return jobs
+
+
+def imap_ordered(func, items, jobs=1):
+  # Yields func(item) for every item, in input order. At most 2 * jobs items
+  # are in flight at any time so results do not pile up in memory when the
+  # consumer is slower than the workers.
+  jobs = job_count(jobs)
+  if jobs == 1:
+    for item in items:
+      yield func(item)
+    return
+  with ProcessPoolExecutor(max_workers=jobs) as executor:
+    pending = deque()
+    for item in items:
+      pending.append(executor.submit(func, item))
+      if len(pending) >= 2 * jobs:
+        yield pending.popleft().result()
+    while pending:
+      yield pending.popleft().result()
+
+
+def encode_messages(collect, backend=None):
+  # Runs collect(on_message) and returns (encoded JSONL bytes, message count)
+  # using the same encoder as the parent MessageWriter.
+  buf = io.BytesIO()
+  writer = MessageWriter(buf, backend=backend)
+  collect(writer.write)
+  writer.flush()
+  return buf.getvalue(), writer.count
+
+
+def encode_sorted_messages(collect, backend=None):
+  # Like encode_messages, but returns a list of (posix time, JSONL line)
+  # pairs sorted by timestamp. The sort is stable, so messages sharing a
+  # timestamp keep their input order.
+  writer = MessageWriter(io.BytesIO(), backend=backend)
+  lines = []
+  collect(lambda message: lines.append((parse_rfc3339(message['ts']), writer.encode(message))))
+  lines.sort(key=itemgetter(0))
+  return lines
@@ -0,0 +1,240 @@
+# Validation of JSONL records against ty.Message (pkg/ty/message.go).
+#
+# Besides what would make json.Unmarshal fail on the server, records are
+# checked for the fields every importer is expected to fill: an RFC3339 `ts`
+# with a time zone, a string `platform`, `from`, a `to` target of the right
+# shape and a string `text`. Platforms are not checked against a list, the
+# server takes any string and import-miranda-db.py emits 'netsend'. Every
+# problem is reported as an error class (e.g. 'ts-format', 'unknown-field')
+# and a human readable detail.
+#
+# Fields ty.Message does not have are ignored by json.Unmarshal, so they are
+# only warnings unless the validation is strict.
+
+import re
+from collections import Counter
+from datetime import datetime
+
+from .writer import MESSAGE_FIELDS, get_loads
+
+_FIELDS = frozenset(MESSAGE_FIELDS)
+_REQUIRED = ('ts', 'platform', 'from', 'to', 'text')
+
+# Classes of problems the server accepts
+WARNING_CLASSES = frozenset(('unknown-field',))
+
+# time.RFC3339 as accepted by Go's time.Time UnmarshalJSON
+_RFC3339_RE = re.compile(r'(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)(?:\.\d+)?(?:Z|[+-](\d\d):(\d\d))\Z')
+
+
+def _type_name(value):
+  if value is None:
+    return 'null'
+  if isinstance(value, dict):
+    return 'object'
+  if isinstance(value, list):
+    return 'array'
+  return type(value).__name__
+
+
+# Dates already checked by validate_ts, archives repeat the same days
+_valid_dates = set()
+
+
+def validate_ts(ts):
+  # Returns None for a valid RFC3339 timestamp or the reason it is not
+  m = _RFC3339_RE.match(ts)
+  if m is None:
+    return f"not RFC3339 with a time zone: {ts!r}"
+  year, month, day, hour, minute, second, off_hour, off_minute = m.groups()
+  if hour > '23' or minute > '59' or second > '59':
+    return f"time of day out of range: {ts!r}"
+  if off_hour is not None and (off_hour > '23' or off_minute > '59'):
+    return f"time zone offset out of range: {ts!r}"
+  date = ts[:10]
+  if date not in _valid_dates:
+    try:
+      datetime(int(year), int(month), int(day))
+    except ValueError as e:
+      return f"{e}: {ts!r}"
+    _valid_dates.add(date)
+  return None
+
+
+def _validate_to(to, errors):
+  if not isinstance(to, dict):
+    errors.append(('to-type', f"expected an object, got {_type_name(to)}"))
+    return
+  target_type = to.get('type')
+  if target_type == 'user':
+    key = 'user_id'
+  elif target_type == 'group':
+    key = 'group_id'
+  else:
+    errors.append(('to-target-type', f"expected 'user' or 'group', got {target_type!r}"))
+    return
+  target = to.get(key)
+  if not isinstance(target, str) or not target:
+    errors.append((f"to-{key.replace('_', '-')}", f"{target_type} target without a string {key}"))
+
+
+def _validate_attachments(attachments, errors):
+  if attachments is None:
+    return
+  if not isinstance(attachments, list):
+    errors.append(('attachments-type', f"expected an array, got {_type_name(attachments)}"))
+    return
+  for attachment in attachments:
+    if not isinstance(attachment, dict) or not all(
+        isinstance(attachment.get(key, ''), str) for key in ('file_name', 'mime_type')):
+      errors.append(('attachments-type', f"invalid attachment {attachment!r}"))
+      return
+
+
+def _is_valid(m):
+  # Fast check for the common case of a valid record, validate_message
+  # collects the details otherwise
+  ts = m.get('ts')
+  to = m.get('to')
+  if (type(ts) is not str or type(m.get('platform')) is not str
+      or type(m.get('from')) is not str or type(m.get('text')) is not str
+      or type(to) is not dict or not _FIELDS.issuperset(m)):
+    return False
+  target_type = to.get('type')
+  if target_type == 'user':
+    target = to.get('user_id')
+  elif target_type == 'group':
+    target = to.get('group_id')
+  else:
+    return False
+  if type(target) is not str or not target:
+    return False
+  attachments = m.get('attachments')
+  if attachments is not None:
+    if type(attachments) is not list:
+      return False
+    for attachment in attachments:
+      if (type(attachment) is not dict or type(attachment.get('file_name', '')) is not str
+          or type(attachment.get('mime_type', '')) is not str):
+        return False
+  if type(m.get('meta', {})) not in (dict, type(None)):
+    return False
+  return validate_ts(ts) is None
+
+
+def validate_message(m):
+  # Returns a list of (error class, detail) for a decoded record, empty when
+  # the record is valid
+  if not isinstance(m, dict):
+    return [('not-object', f"expected an object, got {_type_name(m)}")]
+  if _is_valid(m):
+    return []
+  errors = []
+  for key in _REQUIRED:
+    if key not in m:
+      errors.append((f"{key}-missing", f"no {key!r} field"))
+
+  if 'ts' in m:
+    ts = m['ts']
+    if not isinstance(ts, str):
+      errors.append(('ts-type', f"expected a string, got {_type_name(ts)}"))
+    else:
+      reason = validate_ts(ts)
+      if reason is not None:
+        errors.append(('ts-format', reason))
+
+  if 'platform' in m:
+    platform = m['platform']
+    if not isinstance(platform, str):
+      errors.append(('platform-type', f"expected a string, got {_type_name(platform)}"))
+
+  if 'from' in m and not isinstance(m['from'], str):
+    errors.append(('from-type', f"expected a string, got {_type_name(m['from'])}"))
+  if 'to' in m:
+    _validate_to(m['to'], errors)
+  if 'text' in m and not isinstance(m['text'], str):
+    errors.append(('text-type', f"expected a string, got {_type_name(m['text'])}"))
+
+  _validate_attachments(m.get('attachments'), errors)
+  meta = m.get('meta')
+  if meta is not None and not isinstance(meta, dict):
+    errors.append(('meta-type', f"expected an object, got {_type_name(meta)}"))
+
+  for key in m:
+    if key not in _FIELDS:
+      errors.append(('unknown-field', f"unknown field {key!r}"))
+  return errors
+
+
+def validate_line(line, loads):
+  if not line.strip():
+    return [('empty-line', "empty line")]
+  try:
+    m = loads(line)
+  except ValueError as e:
+    try:
+      line.decode('utf-8')
+    except UnicodeDecodeError as ue:
+      return [('invalid-utf8', str(ue))]
+    return [('invalid-json', str(e))]
+  return validate_message(m)
+
+
+class ValidationResult:
+  # Line count, error and warning counts by class and the first
+  # `max_examples` problems of every class as (line number, byte offset,
+  # class, detail, severity)
+
+  def __init__(self, max_examples=10):
+    self.max_examples = max_examples
+    self.lines = 0
+    self.invalid = 0
+    self.counts = Counter()
+    self.warnings = Counter()
+    self.examples = []
+    self._example_counts = Counter()
+
+  def _add_example(self, line_number, offset, error_class, detail, severity):
+    if self._example_counts[error_class] < self.max_examples:
+      self._example_counts[error_class] += 1
+      self.examples.append((line_number, offset, error_class, detail, severity))
+
+  def add_error(self, line_number, offset, error_class, detail):
+    self.counts[error_class] += 1
+    self._add_example(line_number, offset, error_class, detail, 'error')
+
+  def add_warning(self, line_number, offset, error_class, detail):
+    self.warnings[error_class] += 1
+    self._add_example(line_number, offset, error_class, detail, 'warning')
+
+  def merge(self, other):
+    # Appends the result of the lines that follow the ones of this result
+    for line_number, offset, error_class, detail, severity in other.examples:
+      self._add_example(self.lines + line_number, offset, error_class, detail, severity)
+    self.counts.update(other.counts)
+    self.warnings.update(other.warnings)
+    self.lines += other.lines
+    self.invalid += other.invalid
+    return self
+
+
+def validate_chunk(chunk, max_examples=10, strict=False):
+  # memento.chunked worker, line numbers are relative to the chunk. Unless
+  # strict, problems in WARNING_CLASSES do not make a line invalid.
+  _name, loads = get_loads()
+  result = ValidationResult(max_examples)
+  for offset, line in chunk.lines():
+    result.lines += 1
+    errors = validate_line(line, loads)
+    if not errors:
+      continue
+    invalid = False
+    for error_class, detail in errors:
+      if not strict and error_class in WARNING_CLASSES:
+        result.add_warning(result.lines, offset, error_class, detail)
+      else:
+        result.add_error(result.lines, offset, error_class, detail)
+        invalid = True
+    if invalid:
+      result.invalid += 1
+  return result
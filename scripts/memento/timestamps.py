@@ -0,0 +1,142 @@
+# Timestamp helpers shared by the importer scripts and archive tools.
+
+import calendar
+import re
+from datetime import datetime, timezone
+from functools import lru_cache
+
+
+def parse_rfc3339(ts):
+  # Returns the POSIX time of an RFC3339 timestamp such as the `ts` field of
+  # ty.Message. Naive timestamps are taken as UTC.
+  if ts.endswith('Z'):
+    ts = ts[:-1] + '+00:00'
+  dt = datetime.fromisoformat(ts)
+  if dt.tzinfo is None:
+    dt = dt.replace(tzinfo=timezone.utc)
+  return dt.timestamp()
+
+
+_FRACTION_RE = re.compile(r'\.(\d+)')
+
+
+def rfc3339_nanos(ts):
+  # Exact nanoseconds since the epoch of an RFC3339 timestamp, the precision
+  # of Go's time.Time. Fractions beyond nanoseconds are truncated like Go does.
+  nanos = 0
+  m = _FRACTION_RE.search(ts)
+  if m is not None:
+    nanos = int(m.group(1)[:9].ljust(9, '0'))
+    ts = ts[:m.start()] + ts[m.end():]
+  return int(parse_rfc3339(ts)) * 1000000000 + nanos
+
+
+# Separators of a date string or format: everything that is not a letter,
+# digit or whitespace. The directives below never produce separators, so a
+# format can only match strings with exactly its own separators.
+_SEPARATORS = re.compile(r'[\w\s]+')
+_DIRECTIVE = re.compile(r'%[aAbBdHIjmMpSyYf]')
+
+
+def _separators(text):
+  return _SEPARATORS.sub('', text)
+
+
+def _format_separators(fmt):
+  # Formats using other directives (%z, %Z, ...) may match any string
+  literals = _DIRECTIVE.sub('', fmt.replace('%%', '\0'))
+  if '%' in literals:
+    return None
+  return _separators(literals.replace('\0', '%'))
+
+
+_MONTHS = {name.lower(): i for i, name in enumerate(calendar.month_name) if name}
+_MONTH_ABBRS = {name.lower(): i for i, name in enumerate(calendar.month_abbr) if name}
+_DAYS = {name.lower() for name in calendar.day_name}
+_DAY_ABBRS = {name.lower() for name in calendar.day_abbr}
+
+_ISO_RE = re.compile(r'(\d{4})-(\d\d)-(\d\d)[ T](\d\d):(\d\d):(\d\d)\Z')
+_CTIME_RE = re.compile(r'([A-Za-z]+) +([A-Za-z]+) +(\d{1,2}) (\d\d):(\d\d):(\d\d) (\d{4})\Z')
+_LONG_DATE_RE = re.compile(r'([A-Za-z]+), (\d{1,2}) ([A-Za-z]+) (\d{4}) at (\d\d):(\d\d):(\d\d)\Z')
+
+
+def _parse_iso(text, sep):
+  # 2017-02-01 09:23:03
+  m = _ISO_RE.match(text)
+  if m is None or text[10] != sep:
+    return None
+  return datetime(*map(int, m.groups()))
+
+
+def _parse_ctime(text):
+  # Thu Jan 24 21:54:39 2002
+  m = _CTIME_RE.match(text)
+  if m is None or m.group(1).lower() not in _DAY_ABBRS:
+    return None
+  month = _MONTH_ABBRS.get(m.group(2).lower())
+  if month is None:
+    return None
+  day, hour, minute, second, year = map(int, m.groups()[2:])
+  return datetime(year, month, day, hour, minute, second)
+
+
+def _parse_long_date(text):
+  # Sunday, 1 March 2000 at 09:33:50
+  m = _LONG_DATE_RE.match(text)
+  if m is None or m.group(1).lower() not in _DAYS:
+    return None
+  month = _MONTHS.get(m.group(3).lower())
+  if month is None:
+    return None
+  day, year, hour, minute, second = map(int, m.group(2, 4, 5, 6, 7))
+  return datetime(year, month, day, hour, minute, second)
+
+
+# Hand written parsers for the fixed layouts found in the exports. They
+# return None for anything they do not recognise and leave it to strptime.
+FAST_PARSERS = {
+  '%Y-%m-%d %H:%M:%S': lambda text: _parse_iso(text, ' '),
+  '%Y-%m-%dT%H:%M:%S': lambda text: _parse_iso(text, 'T'),
+  '%a %b %d %H:%M:%S %Y': _parse_ctime,
+  '%A, %d %B %Y at %H:%M:%S': _parse_long_date,
+}
+
+
+class DateParser:
+  # Parses date strings with the first of `formats` that matches, like
+  # trying datetime.strptime with each of them in turn. Every string shape
+  # remembers the formats that can match it, so a file in a single layout
+  # costs one strptime per string instead of one failure per earlier
+  # format. Results are memoized since exports repeat the same dates.
+
+  def __init__(self, *formats, cache_size=4096):
+    self.formats = [(fmt, _format_separators(fmt)) for fmt in formats]
+    self.candidates = {}
+    self.parse = lru_cache(maxsize=cache_size)(self._parse)
+
+  def _candidates(self, text):
+    separators = _separators(text)
+    formats = self.candidates.get(separators)
+    if formats is None:
+      formats = self.candidates[separators] = [
+        fmt for fmt, fmt_separators in self.formats
+        if fmt_separators is None or fmt_separators == separators
+      ]
+    return formats
+
+  def _parse(self, text):
+    # Returns a naive datetime, or None if no format matches
+    for fmt in self._candidates(text):
+      fast = FAST_PARSERS.get(fmt)
+      if fast is not None:
+        try:
+          dt = fast(text)
+        except ValueError:
+          dt = None
+        if dt is not None:
+          return dt
+      try:
+        return datetime.strptime(text, fmt)
+      except ValueError:
+        continue
+    return None
@@ -0,0 +1,131 @@
+# Buffered JSONL sink for ty.Message records.
+#
+# Records are plain dicts and are encoded with orjson or ujson when one of them
+# is installed, falling back to the stdlib encoder. All backends produce
+# compact, non-ASCII-escaped output. Encoded lines are collected in batches
+# and written to a large output buffer instead of one `print` per message.
+#
+# Usage:
+#   with MessageWriter() as writer:
+#     collect_messages(directory, writer.write)
+
+import json
+import os
+import sys
+
+BUFFER_SIZE = 1 << 20
+BATCH_SIZE = 1024
+
+# Field order of the Go ty.Message struct
+MESSAGE_FIELDS = ('ts', 'platform', 'from', 'to', 'text', 'raw', 'attachments', 'meta')
+
+
+def _stdlib_dumps(obj):
+  return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def _load_backend(name):
+  if name == 'orjson':
+    import orjson
+    return orjson.dumps
+  if name == 'ujson':
+    import ujson
+    return lambda obj: ujson.dumps(obj, ensure_ascii=False, escape_forward_slashes=False).encode('utf-8')
+  if name == 'json':
+    return _stdlib_dumps
+  raise ValueError(f"Unknown JSON backend: {name}")
+
+
+def get_dumps(backend=None):
+  # Returns (name, dumps) where dumps encodes an object to bytes.
+  # The backend can be forced with the MEMENTO_JSON environment variable.
+  backend = backend or os.environ.get('MEMENTO_JSON')
+  if backend:
+    return backend, _load_backend(backend)
+  for name in ('orjson', 'ujson'):
+    try:
+      return name, _load_backend(name)
+    except ImportError:
+      continue
+  return 'json', _stdlib_dumps
+
+
+def get_loads(backend=None):
+  # Returns (name, loads) where loads decodes a JSON line (bytes or str)
+  backend = backend or os.environ.get('MEMENTO_JSON')
+  names = (backend,) if backend else ('orjson', 'ujson')
+  for name in names:
+    if name == 'json':
+      break
+    try:
+      module = __import__(name)
+    except ImportError:
+      if backend:
+        raise
+      continue
+    return name, module.loads
+  return 'json', json.loads
+
+
+class MessageWriter:
+  def __init__(self, stream=None, batch_size=BATCH_SIZE, backend=None):
+    # stream is a binary file object, a file name, or None/'-' for stdout
+    self._own_stream = stream is None or isinstance(stream, str)
+    if stream is None or stream == '-':
+      sys.stdout.flush()
+      stream = open(sys.stdout.fileno(), 'wb', buffering=BUFFER_SIZE, closefd=False)
+    elif isinstance(stream, str):
+      stream = open(stream, 'wb', buffering=BUFFER_SIZE)
+    self.stream = stream
+    self.batch_size = batch_size
+    self.backend, self._dumps = get_dumps(backend)
+    self._batch = []
+    self.count = 0
+
+  def encode(self, record):
+    # Encodes a single record to a newline terminated JSON line
+    try:
+      return self._dumps(record) + b'\n'
+    except TypeError:
+      # e.g. non-string keys or integers that the fast backends refuse
+      return _stdlib_dumps(record) + b'\n'
+
+  def write(self, record):
+    self._batch.append(self.encode(record))
+    self.count += 1
+    if len(self._batch) >= self.batch_size:
+      self._drain()
+
+  def write_encoded(self, data, count=1):
+    # Writes already encoded JSON lines, e.g. produced by worker processes.
+    # Whole files of lines are passed straight to the stream buffer instead
+    # of being batched.
+    self.count += count
+    if len(data) >= BUFFER_SIZE // self.batch_size:
+      self._drain()
+      self.stream.write(data)
+      return
+    self._batch.append(data)
+    if len(self._batch) >= self.batch_size:
+      self._drain()
+
+  def _drain(self):
+    if self._batch:
+      self.stream.write(b''.join(self._batch))
+      self._batch = []
+
+  def flush(self):
+    self._drain()
+    self.stream.flush()
+
+  def close(self):
+    self.flush()
+    if self._own_stream:
+      self.stream.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+    return False
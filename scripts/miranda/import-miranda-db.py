@@ -6,15 +6,14 @@
 # python3 scripts/miranda/import-miranda-sqlite3-dump.py messages -d export.sqlite3 -u <user_uin> > messages.json
 
 import argparse
-from datetime import timezone
+import os
+import sys
+from time import gmtime, strftime
 import json
-from vendor.mirandat3.mirandat3 import DBHeader, DBContact, Encoder
-from collections import OrderedDict
+from vendor.mirandat3.mirandat3 import DBHeader, DBContact, Encoder, iter_contacts, map_database
 
-def format_utc_seconds(dt):
-    if dt.tzinfo is None:
-        dt = dt.replace(tzinfo=timezone.utc)
-    return dt.astimezone(timezone.utc).replace(microsecond=0).isoformat().replace('+00:00', 'Z')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from memento.writer import MessageWriter
 
 def get_platform(p):
     if p == 'JABBER' or p == 'jabber':
@@ -65,32 +64,33 @@ def get_contact(c: DBContact, on_contact):
     })
 
 def get_messages(c: DBContact, owner_id, on_message):
+    # Everything that only depends on the contact is resolved once, per event
+    # only the header fields and the blob are read
     platform = get_platform(c.settings.get("p"))
-    user_id = get_id(c.settings)
-    messages = []
+    user_id = str(get_id(c.settings))
+    owner_id = str(owner_id)
+    incoming_to = {"type": "user", "user_id": owner_id}
+    outgoing_to = {"type": "user", "user_id": user_id}
+    metas = {}
     for e in c.events:
-        if e.dir() == '<':
-            m_from = str(user_id)
-            m_to = {"type": "user", "user_id": str(owner_id)}
+        if e.is_sent():
+            m_from = owner_id
+            m_to = outgoing_to
         else:
-            m_from = str(owner_id)
-            m_to = {"type": "user", "user_id": str(user_id)}
-        on_message(OrderedDict({
-            "ts": format_utc_seconds(e.timestamp),
-            "platform": get_platform(platform),
+            m_from = user_id
+            m_to = incoming_to
+        meta = metas.get(e.type)
+        if meta is None:
+            meta = metas[e.type] = {"type": e.typestr()}
+        on_message({
+            "ts": strftime("%Y-%m-%dT%H:%M:%SZ", gmtime(e.ts)),
+            "platform": platform,
             "from": m_from,
             "to": m_to,
             "text": e.parse_blob(),
-            "meta": {
-                "type": e.typestr()
-            }
-        }))
+            "meta": meta
+        })
 
-    return messages
-
-
-def cb_on_message(message):
-    print(json.dumps(message, ensure_ascii=False))
 
 def main():
     parser = argparse.ArgumentParser(description="Import contacts and messages from Miranda SQLite dump")
@@ -106,21 +106,16 @@ def main():
 
     Encoder.encoding = args.encoding
 
-    dat = None
-    with open(args.file, 'rb') as f:
-        dat = f.read()
+    dat = map_database(args.file)
     header = DBHeader(dat)
 
-    next_contact = header.firstContact
     contacts = []
-    messages = []
-    while next_contact != 0:
-        c = DBContact(dat, next_contact)
-        if args.mode == "contacts":
-            get_contact(c, contacts.append)
-        if args.mode == "messages":
-            messages += get_messages(c, owner_id, cb_on_message)
-        next_contact = c.next
+    with MessageWriter() as writer:
+        for c in iter_contacts(dat, header):
+            if args.mode == "contacts":
+                get_contact(c, contacts.append)
+            if args.mode == "messages":
+                get_messages(c, owner_id, writer.write)
 
     if args.mode == "contacts":
         print(json.dumps(contacts, indent=2, ensure_ascii=False))
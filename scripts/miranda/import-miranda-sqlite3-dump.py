@@ -3,13 +3,121 @@
 #
 # Usage:
 # python3 scripts/miranda/import-miranda-sqlite3-dump.py contacts -d export.sqlite3 > contacts.json
-# python3 scripts/miranda/import-miranda-sqlite3-dump.py messages -d export.sqlite3 -u <user_uin> > messages.json
+# python3 scripts/miranda/import-miranda-sqlite3-dump.py messages -d export.sqlite3 -u <user_uin> > messages.jsonl
 
 import sqlite3
 import json
+import os
 import sys
 import argparse
-from datetime import datetime
+from datetime import datetime, timezone
+from itertools import groupby
+from time import gmtime, strftime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from memento.writer import MessageWriter
+
+FETCH_SIZE = 10000
+
+
+def decode(value):
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+def fetch_rows(cur, batch_size=FETCH_SIZE):
+    # Streams the rows of an executed query in batches
+    while True:
+        rows = cur.fetchmany(batch_size)
+        if not rows:
+            break
+        yield from rows
+
+
+def collect_contacts(conn):
+    # Contacts and their settings come from a single ordered join instead of
+    # one settings query per contact
+    contacts = []
+    cur = conn.execute("""
+        SELECT c.id, c.name, s.name, s.value
+        FROM contacts c LEFT JOIN settings s ON s.owner = c.id
+        ORDER BY c.id, s.id
+    """)
+    for c_id, rows in groupby(fetch_rows(cur), key=lambda row: row[0]):
+        settings = {}
+        name = None
+        for _c_id, c_name, key, val in rows:
+            name = decode(c_name)
+            if key is not None:
+                settings[decode(key)] = decode(val)
+        uin = settings.get('UIN')
+        if not uin and 'MyHandle' in settings:
+            uin = settings['MyHandle']
+        # Always include the contact, use uin or fallback
+        platform_id = uin if uin else str(c_id)
+        platform = "icq" if uin else "unknown"
+        contacts.append({
+            "name": name,
+            "platforms": [{
+                "id": platform_id,
+                "platform": platform,
+                "name": name,
+                "avatar": "",
+                "meta": settings,
+            }]
+        })
+    return contacts
+
+
+def format_timestamp(ts):
+    # New dumps store the POSIX time of the event. Older mirandat3 exports
+    # store str(datetime.fromtimestamp(ts)), the local wall clock time of the
+    # machine that ran the export, which is converted assuming the same
+    # time zone. Both give the same UTC timestamp as import-miranda-db.py.
+    if isinstance(ts, int):
+        return strftime("%Y-%m-%dT%H:%M:%SZ", gmtime(ts))
+    dt = datetime.strptime(decode(ts), '%Y-%m-%d %H:%M:%S').astimezone(timezone.utc)
+    return dt.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def find_user_uin(conn):
+    for row in conn.execute("SELECT value FROM settings WHERE name = ?", (b'MyHandle',)):
+        return decode(row[0])
+    return None
+
+
+def collect_messages(conn, user_uin, on_message):
+    # Build dict of owner to UIN
+    uin_dict = {}
+    for owner, uin_val in conn.execute("SELECT owner, value FROM settings WHERE name = ?", (b'UIN',)):
+        uin_dict[owner] = decode(uin_val)
+
+    user_uin = str(user_uin)
+    cur = conn.execute(
+        "SELECT owner, direction, timestamp, data FROM events WHERE type IN (?, ?)",
+        (b'Message', 'Message'))
+    for owner, direction, ts, data in fetch_rows(cur):
+        # Get UIN of owner
+        uin = uin_dict.get(owner)
+        if not uin:
+            continue
+        # '>' marks events sent by the owner, see DBEvent.dir in mirandat3
+        if decode(direction) == '>':
+            m_from = user_uin
+            m_to = {"type": "user", "user_id": str(uin)}
+        else:
+            m_from = str(uin)
+            m_to = {"type": "user", "user_id": user_uin}
+        on_message({
+            "platform": "icq",
+            "ts": format_timestamp(ts),
+            "from": m_from,
+            "to": m_to,
+            "text": decode(data),
+            "raw": None,
+            "attachments": [],
+            "meta": {}
+        })
+
 
 def main():
     parser = argparse.ArgumentParser(description="Import contacts and messages from Miranda SQLite dump")
@@ -20,93 +128,26 @@ def main():
     args = parser.parse_args()
 
     mode = args.mode
-    db_file = args.database
     user_uin = args.user
 
-    conn = sqlite3.connect(db_file)
-    cur = conn.cursor()
-    cur_settings = conn.cursor()  # Separate cursor for settings queries
+    conn = sqlite3.connect(args.database)
 
     if mode == 'contacts':
-        cur = conn.cursor()
-
-        contacts = []
-        for row in cur.execute("SELECT id, name FROM contacts"):
-            c_id, name = row
-            name = name.decode('utf-8') if isinstance(name, bytes) else name
-            settings = {}
-            for s_row in cur_settings.execute("SELECT name, value FROM settings WHERE owner = ?", (c_id,)):
-                key = s_row[0].decode('utf-8') if isinstance(s_row[0], bytes) else s_row[0]
-                val = s_row[1].decode('utf-8') if isinstance(s_row[1], bytes) else s_row[1]
-                settings[key] = val
-            uin = settings.get('UIN')
-            if not uin and 'MyHandle' in settings:
-                uin = settings['MyHandle']
-            # Always include the contact, use uin or fallback
-            platform_id = uin if uin else str(c_id)
-            platform = "icq" if uin else "unknown"
-            user = {
-                "name": name,
-                "platforms": [{
-                    "id": platform_id,
-                    "platform": platform,
-                    "name": name,
-                    "avatar": "",
-                    "meta": settings,
-                }]
-            }
-            contacts.append(user)
+        contacts = collect_contacts(conn)
         print(json.dumps(contacts, indent=2, ensure_ascii=False))
 
     elif mode == 'messages':
         if not user_uin:
             # Find user UIN from DB
-            for row in cur_settings.execute("SELECT value FROM settings WHERE name = ?", (b'MyHandle',)):
-                user_uin = row[0].decode('utf-8') if isinstance(row[0], bytes) else row[0]
-                break
+            user_uin = find_user_uin(conn)
         if not user_uin:
             print("User UIN not found. Provide with -u option.")
             sys.exit(1)
 
-        # Build dict of owner to UIN
-        uin_dict = {}
-        for row in cur.execute("SELECT owner, value FROM settings WHERE name = ?", (b'UIN',)):
-            owner = row[0]
-            uin_val = row[1].decode('utf-8') if isinstance(row[1], bytes) else row[1]
-            uin_dict[owner] = uin_val
-
-        messages = []
-        for row in cur.execute("SELECT owner, direction, timestamp, type, data FROM events"):
-            owner, direction, ts, typ, data = row
-            typ = typ.decode('utf-8') if isinstance(typ, bytes) else typ
-            direction = direction.decode('utf-8') if isinstance(direction, bytes) else direction
-            if typ == 'Message':
-                data = data.decode('utf-8') if isinstance(data, bytes) else data
-                # Parse timestamp string to datetime
-                dt = datetime.strptime(ts, '%Y-%m-%d %H:%M:%S')
-                # Get UIN of owner
-                uin = uin_dict.get(owner)
-                if direction == '>':
-                    m_from = str(uin)
-                    m_to = {"type": "user", "user_id": str(user_uin)},
-                else:
-                    m_from = str(user_uin)
-                    m_to = {"type": "user", "user_id": str(uin)},
-                if uin:
-                    message = {
-                        "platform": "icq",
-                        "ts": dt.isoformat(),
-                        "from": m_from,
-                        "to": m_to,
-                        "text": data,
-                        "raw": None,
-                        "attachments": [],
-                        "meta": {}
-                    }
-                    messages.append(message)
-        print(json.dumps(messages, indent=2, ensure_ascii=False))
+        with MessageWriter() as writer:
+            collect_messages(conn, user_uin, writer.write)
 
     conn.close()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,131 @@
+# Checks that import-miranda-db.py and import-miranda-sqlite3-dump.py agree on
+# the messages of the same profile, so overlapping imports deduplicate.
+#
+# Usage:
+# python3 -m unittest discover -s scripts/miranda
+
+import json
+import os
+import struct
+import subprocess
+import sys
+import tempfile
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+OWNER = "555"
+
+CONTACT_SIG = 0x43DECADE
+MODULENAME_SIG = 0x4DDECADE
+EVENT_SIG = 0x45DECADE
+SETTINGS_SIG = 0x53DECADE
+
+EVENT_MESSAGE = 0
+EVENT_ADDED = 1000
+DBEF_SENT = 2
+DBEF_UTF = 16
+
+
+class ProfileBuilder:
+    # Writes a minimal Miranda .dat profile of ICQ contacts
+
+    def __init__(self):
+        self.buf = bytearray(44)
+        self.modules = {}
+        self.contacts = []
+
+    def alloc(self, data):
+        offset = len(self.buf)
+        self.buf.extend(data)
+        return offset
+
+    def module(self, name):
+        if name not in self.modules:
+            data = name.encode()
+            self.modules[name] = self.alloc(struct.pack('<IIB', MODULENAME_SIG, 0, len(data)) + data)
+        return self.modules[name]
+
+    def settings(self, module, items, next_offset=0):
+        blob = b''
+        for name, value in items:
+            blob += struct.pack('<B', len(name)) + name.encode()
+            if isinstance(value, int):
+                blob += struct.pack('<BI', 4, value)
+            else:
+                data = value.encode('latin-1')
+                blob += struct.pack('<BH', 255, len(data)) + data
+        blob += b'\0'
+        return self.alloc(struct.pack('<IIII', SETTINGS_SIG, next_offset, self.module(module), len(blob)) + blob)
+
+    def contact(self, uin, events):
+        # events are (POSIX time, flags, type, text)
+        icq = self.settings('ICQ', [('UIN', uin), ('Nick', f'nick{uin}')])
+        protocol = self.settings('Protocol', [('p', 'ICQ')], icq)
+        offsets = []
+        for ts, flags, event_type, text in events:
+            blob = text.encode('utf-8' if flags & DBEF_UTF else 'latin-1') + b'\0'
+            prev = offsets[-1] if offsets else 0
+            offset = self.alloc(struct.pack('<IIIIIIHI', EVENT_SIG, prev, 0, self.module('ICQ'),
+                                            ts, flags, event_type, len(blob)) + blob)
+            if offsets:
+                struct.pack_into('<I', self.buf, offsets[-1] + 8, offset)
+            offsets.append(offset)
+        offset = self.alloc(struct.pack('<IIIIIIII', CONTACT_SIG, 0, protocol, len(offsets),
+                                        offsets[0] if offsets else 0, offsets[-1] if offsets else 0, 0, 0))
+        if self.contacts:
+            struct.pack_into('<I', self.buf, self.contacts[-1] + 4, offset)
+        self.contacts.append(offset)
+
+    def save(self, path):
+        user = self.alloc(struct.pack('<IIIIIIII', CONTACT_SIG, 0, 0, 0, 0, 0, 0, 0))
+        struct.pack_into('<16sHHIIIIII', self.buf, 0, b'Miranda ICQ DB\0\0', 0, 0, len(self.buf), 0,
+                         len(self.contacts), self.contacts[0], user, min(self.modules.values()))
+        with open(path, 'wb') as f:
+            f.write(self.buf)
+
+
+def run(*args, cwd=HERE):
+    env = dict(os.environ, TZ='America/New_York')
+    result = subprocess.run([sys.executable, *args], cwd=cwd, env=env, check=True, capture_output=True)
+    return [json.loads(line) for line in result.stdout.splitlines()]
+
+
+def key(message):
+    return (message['ts'], message['platform'], message['from'], json.dumps(message['to']), message['text'])
+
+
+class ImportersAgreeTest(unittest.TestCase):
+
+    def test_same_messages(self):
+        builder = ProfileBuilder()
+        builder.contact(1001, [
+            (1000000000, 0, EVENT_MESSAGE, 'hi owner'),
+            (1000000037, DBEF_SENT, EVENT_MESSAGE, 'hi contact'),
+            (1000000074, DBEF_SENT | DBEF_UTF, EVENT_MESSAGE, 'ümlaut'),
+            (1000000111, 0, EVENT_ADDED, 'added'),
+        ])
+        builder.contact(1002, [
+            (1010000000, DBEF_UTF, EVENT_MESSAGE, 'привет'),
+            (1010000001, DBEF_SENT, EVENT_MESSAGE, 'bye'),
+        ])
+
+        with tempfile.TemporaryDirectory() as directory:
+            dat = os.path.join(directory, 'profile.dat')
+            builder.save(dat)
+            run(os.path.join(HERE, 'vendor', 'mirandat3', 'mirandat3.py'), dat, 'export', '-f', 'export',
+                cwd=directory)
+            dump = os.path.join(directory, 'export.db3')
+
+            from_dat = run('import-miranda-db.py', 'messages', '-f', dat, '-u', OWNER)
+            from_dump = run('import-miranda-sqlite3-dump.py', 'messages', '-d', dump, '-u', OWNER)
+
+        # The dump importer only takes Message events
+        from_dat = [m for m in from_dat if m['meta']['type'] == 'Message']
+        self.assertEqual(len(from_dat), 5)
+        self.assertEqual([key(m) for m in from_dat], [key(m) for m in from_dump])
+        self.assertEqual(from_dump[1]['from'], OWNER)
+        self.assertEqual(from_dump[1]['to'], {'type': 'user', 'user_id': '1001'})
+
+
+if __name__ == '__main__':
+    unittest.main()
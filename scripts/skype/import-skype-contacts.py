@@ -1,54 +1,37 @@
 # A script to import skype contacts export as memento users for the skype platform,
 # all additional fields to be put as meta data and avatars to be downloaded in ./data/skype/avatar
-# with filename same as the user id
+# named by the hash of their content, see memento/avatars.py
 
 # Skype contacts export is a CSV file with the following headers:
 # type	id	display_name	blocked	favorite	profile.avatar_url	profile.gender	profile.locations[0].type	profile.locations[0].country	profile.locations[0].city	profile.locations[0].state	profile.mood	profile.name.first	profile.name.surname	profile.phones[0].number	profile.phones[0].type	profile.about	profile.phones[1].number	profile.phones[1].type	profile.website	profile.skype_handle	sources	creation_time
 
-# Usage: import-contacts.py contacts.csv > skype-contacts.json
+# Usage: import-contacts.py -f contacts.csv > skype-contacts.json
 
 import argparse
 import csv
 import json
 import os
-import re
 import sys
-import requests
 
-def download_avatar(avatar_url, user_id, avatar_dir):
-    if not avatar_url:
-        return None
-
-    # Sanitize filename: replace invalid characters with underscores
-    safe_filename = re.sub(r'[<>:"/\\|?*]', '_', user_id) + '.jpg'
-    file_path = os.path.join(avatar_dir, safe_filename)
-
-    if os.path.exists(file_path):
-        return safe_filename
-
-    try:
-        response = requests.get(avatar_url)
-        response.raise_for_status()
-
-        # Get file extension from MIME type
-        with open(file_path, 'wb') as f:
-            f.write(response.content)
-        return safe_filename
-    except Exception as e:
-        print(f"Failed to download avatar for {user_id}: {e}", file=sys.stderr)
-        return None
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from memento.avatars import DOWNLOAD_WORKERS, AvatarStore, fetch_avatars
 
 def main():
     parser = argparse.ArgumentParser(description="Import contacts from skype export")
     parser.add_argument("-f", "--file", required=True, help="conacts.csv file")
+    parser.add_argument("-a", "--avatar-dir", default=os.path.join('data', 'skype', 'avatar'),
+                        help="Avatar directory (default: data/skype/avatar)")
+    parser.add_argument("-j", "--jobs", type=int, default=DOWNLOAD_WORKERS,
+                        help=f"Parallel avatar downloads (default: {DOWNLOAD_WORKERS})")
 
     args = parser.parse_args()
 
     csv_file = args.file
-    avatar_dir = os.path.join(os.getcwd(), 'data', 'skype', 'avatar')
-    os.makedirs(avatar_dir, exist_ok=True)
+    store = AvatarStore(args.avatar_dir)
 
     users = []
+    avatars = []
+    avatar_platforms = []
 
     with open(csv_file, 'r', encoding='utf-8') as f:
         reader = csv.DictReader(f)
@@ -61,9 +44,6 @@ def main():
             if not skype_handle:
                 continue  # Skip if no skype handle
 
-            # Download avatar
-            avatar_filename = download_avatar(avatar_url, user_id, avatar_dir) if avatar_url else None
-
             # Meta data: all fields except the ones used for main structure
             meta = {}
             exclude_fields = {'id', 'profile.skype_handle', 'display_name', 'profile.avatar_url'}
@@ -75,7 +55,7 @@ def main():
                 "id": str(skype_handle),
                 "platform": "skype",
                 "name": display_name,
-                "avatar": avatar_filename,
+                "avatar": None,
                 "meta": meta
             }
 
@@ -86,6 +66,16 @@ def main():
 
             users.append(user)
 
+            # Avatars are downloaded together once all rows are read
+            if avatar_url:
+                avatars.append((user_id, avatar_url))
+                avatar_platforms.append((user_id, platform))
+
+    files = fetch_avatars(avatars, store, workers=args.jobs)
+    store.save()
+    for user_id, platform in avatar_platforms:
+        platform["avatar"] = files[user_id]
+
     print(json.dumps(users, indent=2, ensure_ascii=False))
 
 if __name__ == "__main__":
@@ -40,10 +40,15 @@
 # Usage: python3 scripts/skype/import-messages.py messages.json > skype-messages.json
 
 import argparse
-import json
+import html
+import os
+import sys
 from datetime import timezone, datetime
 import re
-from collections import OrderedDict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from memento.jsonstream import get_reader
+from memento.writer import MessageWriter
 
 
 def format_utc_seconds(dt):
@@ -51,30 +56,103 @@ def format_utc_seconds(dt):
         dt = dt.replace(tzinfo=timezone.utc)
     return dt.astimezone(timezone.utc).replace(microsecond=0).isoformat().replace('+00:00', 'Z')
 
-def strip_html(text):
-    # Simple HTML tag remover
-    return re.sub(r'<[^>]+>', '', text)
+# Tags, mentions, entities and links of message content in a single scan.
+# Links are matched from their "://" so every token starts with one of a few
+# characters, the scheme in front of it is checked by parse_content.
+CONTENT_TOKEN_RE = re.compile(
+    r'<[^>]+>'
+    r'|@(\w+)'
+    r'|&(?:#[0-9]+|#[xX][0-9a-fA-F]+|amp|lt|gt|quot|apos);'
+    r'|://[^\s<]+'
+)
+
+# The entities Skype writes into message content, anything else that looks
+# like an entity is left alone
+ENTITY_RE = re.compile(r'&(?:#[0-9]+|#[xX][0-9a-fA-F]+|amp|lt|gt|quot|apos);')
+NAMED_ENTITIES = {'&amp;': '&', '&lt;': '<', '&gt;': '>', '&quot;': '"', '&apos;': "'"}
+
+def decode_entity(entity):
+    # html.unescape maps invalid character references to U+FFFD
+    return NAMED_ENTITIES.get(entity) or html.unescape(entity)
+
+def decode_entities(text):
+    return ENTITY_RE.sub(lambda m: decode_entity(m.group()), text)
+
+def parse_content(content):
+    # Returns (text, links, mentions): the content with HTML tags removed and
+    # entities decoded, and the links and the @mentions outside of tags and links
+    if '<' not in content and '&' not in content and '@' not in content and '://' not in content:
+        return content, [], []
+    parts = []
+    links = []
+    mentions = []
+    pos = 0
+    for m in CONTENT_TOKEN_RE.finditer(content):
+        start = m.start()
+        char = content[start]
+        if char == '@':
+            mentions.append(m.group(1))
+            continue
+        if char == ':':
+            if content.endswith('https', 0, start):
+                start -= 5
+            elif content.endswith('http', 0, start):
+                start -= 4
+            else:
+                continue
+            link = content[start:m.end()]
+            if '&' not in link:
+                links.append(link)
+                continue
+            link = decode_entities(link)
+            links.append(link)
+            parts.append(content[pos:max(start, pos)])
+            parts.append(link)
+        else:
+            parts.append(content[pos:start])
+            if char == '&':
+                parts.append(decode_entity(m.group()))
+        pos = m.end()
+    parts.append(content[pos:])
+    return ''.join(parts), links, mentions
 
 def get_user_id(s: str) -> str:
     _before, sep, after = s.partition(":")
     return after if sep else s
 
-def main():
-    parser = argparse.ArgumentParser(description="Import messages from skype export")
-    parser.add_argument("-f", "--file", required=True, help="messages.json file")
-    parser.add_argument("-u", "--user", required=True, help="UserID of the owner")
-
-    args = parser.parse_args()
-
-    messages_file = args.file
-    owner_id = args.user
+def _stream_messages(reader):
+    for _ in reader.array():
+        yield reader.value()
 
-    with open(messages_file, 'r', encoding='utf-8') as f:
-        data = json.load(f)
+def iter_conversations(reader):
+    # Streams the export one message at a time. Yields (conversation,
+    # messages) where conversation holds the fields other than MessageList
+    # and messages must be consumed before the next conversation is read.
+    for key in reader.object():
+        if key != 'conversations':
+            reader.skip()
+            continue
+        for _ in reader.array():
+            conv = {}
+            pending = None
+            for conv_key in reader.object():
+                if conv_key != 'MessageList':
+                    conv[conv_key] = reader.value()
+                elif 'id' in conv:
+                    messages = _stream_messages(reader)
+                    yield conv, messages
+                    for _ in messages:
+                        pass
+                else:
+                    # The id comes after the messages, keep them until then
+                    pending = list(_stream_messages(reader))
+            if pending is not None:
+                yield conv, pending
 
-    for conv in data['conversations']:
+def collect_messages(reader, owner_id, on_message):
+    for conv, message_list in iter_conversations(reader):
         conv_id = str(get_user_id(conv['id']))
-        for msg in conv['MessageList']:
+        for msg in message_list:
             ts_str = msg['originalarrivaltime']
             ts = datetime.fromisoformat(ts_str.replace('Z', '+00:00'))
             from_id = str(get_user_id(msg['from']))
@@ -88,22 +166,19 @@ def main():
             to = {"type": "user", "user_id": str(to_user_id)}
             content = msg.get('content', '')
             raw = content
-            text = strip_html(content)
+            text, links, mentions = parse_content(content)
             meta = {}
             if msg.get('properties'):
                 for k, v in msg['properties'].items():
                     if v is not None:
                         meta[str(k)] = str(v)
 
-            # Extract additional data
-            links = re.findall(r'https?://[^\s]+', content)
-            mentions = re.findall(r'@(\w+)', content)
             if links:
                 meta['links'] = links
             if mentions:
                 meta['mentions'] = mentions
 
-            message = OrderedDict({
+            message = {
                 "ts": format_utc_seconds(ts),
                 "platform": "skype",
                 "from": from_id,
@@ -111,8 +186,21 @@ def main():
                 "text": text,
                 "raw": raw,
                 "meta": meta
-            })
-            print(json.dumps(message, ensure_ascii=False))
+            }
+            on_message(message)
+
+def main():
+    parser = argparse.ArgumentParser(description="Import messages from skype export")
+    parser.add_argument("-f", "--file", required=True, help="messages.json file")
+    parser.add_argument("-u", "--user", required=True, help="UserID of the owner")
+
+    args = parser.parse_args()
+
+    messages_file = args.file
+    owner_id = args.user
+
+    with open(messages_file, 'rb') as f, MessageWriter() as writer:
+        collect_messages(get_reader(f), owner_id, writer.write)
 
 if __name__ == "__main__":
     main()
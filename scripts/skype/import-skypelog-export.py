@@ -1,70 +1,84 @@
+import codecs
+import os
 import json
 import argparse
 import sys
 from datetime import datetime, timezone
-from collections import OrderedDict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from memento.contacts import ContactCollector
+from memento.writer import MessageWriter, get_loads
 
 def format_utc_seconds(dt):
   return dt.astimezone(timezone.utc).replace(microsecond=0).isoformat().replace('+00:00', 'Z')
 
-def collect_contacts(file, encoding='utf-8'):
-  contacts = {}
-  with open(file, 'r', encoding=encoding, errors='ignore') as fh:
-    for line in fh:
-      line = line.strip().rstrip(',')
-      if not line:
-        continue
-      rec = json.loads(line)
+def record_contacts(rec, contacts):
+  uid = rec.get('author')
+  if uid not in contacts:
+    contacts.add(uid, uid, 'skype', rec.get('from_dispname'))
 
-      name = rec.get('from_dispname')
-      uid = rec.get('author')
-      if uid not in contacts:
-        contacts[uid] = OrderedDict({
-          'name': name,
-          'platforms': [{
-            'id': uid,
-            'platform': 'skype',
-            'name': name,
-            'avatar': '',
-            'meta': {}
-          }]
-        })
-  return list(contacts.values())
-
-def collect_messages(file, on_message, encoding='utf-8'):
-  with open(file, 'r', encoding=encoding, errors='ignore') as fh:
+def iter_records(file, encoding='utf-8'):
+  # Reads the export in binary mode and parses each line once. Lines are
+  # passed to the fast JSON backend as bytes; only lines it rejects (invalid
+  # UTF-8, other encodings, huge integers, non-ASCII padding) are decoded
+  # with errors='ignore' and parsed by the stdlib like before.
+  _name, loads = get_loads()
+  as_bytes = codecs.lookup(encoding).name == 'utf-8'
+  with open(file, 'rb') as fh:
     for line in fh:
-      line = line.strip().rstrip(',')
-      if not line:
+      if as_bytes:
+        data = line.strip().rstrip(b',')
+        if not data:
+          continue
+        try:
+          rec = loads(data)
+        except ValueError:
+          pass
+        else:
+          yield rec
+          continue
+      text = line.decode(encoding, errors='ignore').strip().rstrip(',')
+      if not text:
         continue
-      rec = json.loads(line)
+      yield json.loads(text)
+
+def collect_contacts(file, encoding='utf-8'):
+  contacts = ContactCollector()
+  for rec in iter_records(file, encoding):
+    record_contacts(rec, contacts)
+  return contacts.values()
 
-      from_uid = rec.get('author')
-      to_uid = rec.get('dialog_partner')
-      text = rec.get('body_xml')
+def collect_messages(file, on_message, encoding='utf-8', contacts=None):
+  # When a ContactCollector is given the authors are collected in the same pass
+  for rec in iter_records(file, encoding):
+    if contacts is not None:
+      record_contacts(rec, contacts)
 
-      ts = datetime.fromtimestamp(rec.get('timestamp'), timezone.utc)
+    from_uid = rec.get('author')
+    to_uid = rec.get('dialog_partner')
+    text = rec.get('body_xml')
 
-      message = OrderedDict({
-        'ts': format_utc_seconds(ts),
-        'platform': 'skype',
-        'from': str(from_uid),
-        'to': {
-          'type': 'user',
-          'user_id': str(to_uid)
-        },
-        'text': text,
-      })
-      on_message(message)
+    ts = datetime.fromtimestamp(rec.get('timestamp'), timezone.utc)
 
-def cb_on_message(message):
-  print(json.dumps(message, ensure_ascii=False))
+    message = {
+      'ts': format_utc_seconds(ts),
+      'platform': 'skype',
+      'from': str(from_uid),
+      'to': {
+        'type': 'user',
+        'user_id': str(to_uid)
+      },
+      'text': text,
+    }
+    on_message(message)
 
 def main():
   parser = argparse.ArgumentParser(description='Import Skypelog jsonl exports')
-  parser.add_argument('command', choices=['contacts', 'messages'])
+  parser.add_argument('command', choices=['contacts', 'messages', 'all'])
   parser.add_argument('-f', '--file', required=True, help='JSONL export file')
   parser.add_argument('-e', '--encoding', default='utf-8', help='File encoding (default: utf-8)')
+  parser.add_argument('-o', '--output', default='messages.jsonl', help='Messages file for the all command (default: messages.jsonl)')
+  parser.add_argument('-c', '--contacts', default='contacts.json', help='Contacts file for the all command (default: contacts.json)')
 
   args = parser.parse_args()
 
@@ -72,7 +86,13 @@ def main():
     contacts = collect_contacts(args.file, args.encoding)
     json.dump(contacts, sys.stdout, indent=2, ensure_ascii=False)
   elif args.command == 'messages':
-    collect_messages(args.file, cb_on_message, args.encoding)
+    with MessageWriter() as writer:
+      collect_messages(args.file, writer.write, args.encoding)
+  elif args.command == 'all':
+    contacts = ContactCollector()
+    with MessageWriter(args.output) as writer:
+      collect_messages(args.file, writer.write, args.encoding, contacts)
+    contacts.dump(args.contacts)
 
 
 if __name__ == '__main__':
@@ -3,11 +3,14 @@ import json
 import argparse
 import sys
 import csv
-from datetime import datetime, timezone
+from datetime import timezone
 from collections import OrderedDict
-from lxml import objectify
 import xml.etree.ElementTree as ET
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from memento.timestamps import DateParser
+from memento.writer import MessageWriter
+
 def format_utc_seconds(dt):
   return dt.astimezone(timezone.utc).replace(microsecond=0).isoformat().replace('+00:00', 'Z')
 
@@ -34,49 +37,61 @@ def collect_contacts(directory, encoding):
           })
   return list(contacts.values())
 
+DATE_FORMATS = DateParser(
+  "%y/%m/%d %H:%M:%S",
+  "%d.%m.%Y г. %H:%M:%S",  # 29.12.2003 г. 21:40:05
+  "%d.%m.%Y г. %H:%M",     # 29.12.2003 г. 21:40
+  "%d.%m.%y 'г.' %H:%M",
+  "%m/%d/%y %H:%M:%S",     # 03/01/09 18:13:51
+  "%y.%m.%d 'y.' %H:%M",   # 09.11.02 'y.' 19:29 (from your XML)
+  "%d.%m.%Y %H:%M:%S",     # 29.12.2003 21:40:05 (without suffix)
+  "%d %m %Y %H %M %S",     # 29.12.2003 21:40:05 (without suffix)
+  "%Y-%m-%d %H:%M:%S",     # Standard ISO format
+  "%d/%m/%Y %H:%M:%S",
+)
+
 def parse_date_time(dt):
   if not dt:
     return None
 
-  formats = [
-    "%y/%m/%d %H:%M:%S",
-    "%d.%m.%Y г. %H:%M:%S",  # 29.12.2003 г. 21:40:05
-    "%d.%m.%Y г. %H:%M",     # 29.12.2003 г. 21:40
-    "%d.%m.%y 'г.' %H:%M",
-    "%m/%d/%y %H:%M:%S",     # 03/01/09 18:13:51
-    "%y.%m.%d 'y.' %H:%M",   # 09.11.02 'y.' 19:29 (from your XML)
-    "%d.%m.%Y %H:%M:%S",     # 29.12.2003 21:40:05 (without suffix)
-    "%d %m %Y %H %M %S",     # 29.12.2003 21:40:05 (without suffix)
-    "%Y-%m-%d %H:%M:%S",     # Standard ISO format
-    "%d/%m/%Y %H:%M:%S",
-  ]
-
-  for fmt in formats:
-    try:
-      return datetime.strptime(dt.strip(), fmt)
-    except ValueError:
-      continue
-
-  raise Exception(f"Unknown time format: {dt}")
+  ts = DATE_FORMATS.parse(dt.strip())
+  if ts is None:
+    raise Exception(f"Unknown time format: {dt}")
+  return ts
 
 def collect_messages_xml(file_name, user_id, on_message, encoding):
+  # Backups can hold years of messages, so the tree is parsed incrementally
+  # and every MESSAGE element is dropped once it has been emitted
   with open(file_name, 'r', encoding=encoding, errors='ignore') as f:
-    content = f.read()
-  root = ET.fromstring(content)
-  for message in root.findall('MESSAGE'):
-    msg = {child.tag: child.text for child in message}
-    mfrom = msg['TELNUM']
-    if msg['DATE'] is None:
-      continue
-    ts = parse_date_time(msg['DATE'])
-    message = OrderedDict({
-      'ts': format_utc_seconds(ts),
-      'platform': 'sms',
-      'from': str(mfrom),
-      'to': {"type": "user", "user_id": user_id},
-      'text': msg['TEXT'],
-    })
-    on_message(message)
+    depth = 0
+    root = None
+    for event, elem in ET.iterparse(f, events=('start', 'end')):
+      if event == 'start':
+        if root is None:
+          root = elem
+        depth += 1
+        continue
+      depth -= 1
+      if depth != 1:
+        continue
+      is_message = elem.tag == 'MESSAGE'
+      if is_message:
+        msg = {child.tag: child.text for child in elem}
+      root.clear()
+      if not is_message:
+        continue
+      mfrom = msg['TELNUM']
+      if msg['DATE'] is None:
+        continue
+      ts = parse_date_time(msg['DATE'])
+      message = {
+        'ts': format_utc_seconds(ts),
+        'platform': 'sms',
+        'from': str(mfrom),
+        'to': {"type": "user", "user_id": user_id},
+        'text': msg['TEXT'],
+      }
+      on_message(message)
 
 def collect_messages_csv(file_name, user_id, on_message, encoding):
   with open(file_name, 'r', encoding=encoding, errors='ignore') as f:
@@ -85,13 +100,13 @@ def collect_messages_csv(file_name, user_id, on_message, encoding):
       ts = parse_date_time(row['Date'])
       number = row['Number']
       text = row['Text']
-      message = OrderedDict({
+      message = {
         'ts': format_utc_seconds(ts),
         'platform': 'sms',
         'from': str(number),
         'to': {"type": "user", "user_id": user_id},
         'text': text,
-      })
+      }
       on_message(message)
 
 def get_number(num):
@@ -101,7 +116,16 @@ def get_number(num):
   return num
 
 def collect_messages_txt(file_name, user_id, on_message, encoding):
-  records = []
+  def emit(record, message_lines):
+    message = {
+      'ts': format_utc_seconds(record['date']),
+      'platform': 'sms',
+      'from': str(record['numbers']),
+      'to': {"type": "user", "user_id": user_id},
+      'text': "\n".join(message_lines).strip(),
+    }
+    on_message(message)
+
   with open(file_name, 'r', encoding=encoding, errors='ignore') as f:
     current_record = {}
     # We use this to capture multi-line messages
@@ -111,10 +135,9 @@ def collect_messages_txt(file_name, user_id, on_message, encoding):
     for line in f:
         # Step 1: Detect the start of a new record
         if line.startswith("Received SMS."):
-            # If we were already working on a record, save it before starting new one
+            # If we were already working on a record, emit it before starting new one
             if current_record:
-                current_record['message'] = "\n".join(message_lines).strip()
-                records.append(current_record)
+                emit(current_record, message_lines)
 
             # Reset for the new record
             current_record = {}
@@ -137,20 +160,9 @@ def collect_messages_txt(file_name, user_id, on_message, encoding):
         elif capturing_message and not line.startswith("---") and line != "":
             message_lines.append(line)
 
-    # Add the very last record after the loop finishes
+    # Emit the very last record after the loop finishes
     if current_record:
-        current_record['message'] = "\n".join(message_lines).strip()
-        records.append(current_record)
-
-  for record in records:
-    message = OrderedDict({
-      'ts': format_utc_seconds(record['date']),
-      'platform': 'sms',
-      'from': str(record['numbers']),
-      'to': {"type": "user", "user_id": user_id},
-      'text': record['message'],
-    })
-    on_message(message)
+        emit(current_record, message_lines)
 
 def collect_messages(directory, user, on_message, encoding):
   for filename in os.listdir(directory):
@@ -161,10 +173,7 @@ def collect_messages(directory, user, on_message, encoding):
     elif filename.endswith('.txt'):
       collect_messages_txt(os.path.join(directory, filename),  user, on_message, encoding)
     else:
-      raise Exception(f"unknown file type: {filetype}")
-
-def cb_on_message(message):
-  print(json.dumps(message, ensure_ascii=False))
+      raise Exception(f"unknown file type: {filename}")
 
 def main():
   parser = argparse.ArgumentParser(description='Import Skypelog jsonl exports')
@@ -179,7 +188,8 @@ def main():
     contacts = collect_contacts(args.directory, args.encoding)
     json.dump(contacts, sys.stdout, indent=2, ensure_ascii=False)
   elif args.command == 'messages':
-    collect_messages(args.directory, args.user, cb_on_message, args.encoding)
+    with MessageWriter() as writer:
+      collect_messages(args.directory, args.user, writer.write, args.encoding)
 
 if __name__ == "__main__":
     main()
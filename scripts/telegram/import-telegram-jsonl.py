@@ -37,13 +37,32 @@
 # Usage:
 # python3 import-telegram-jsonl.py contacts -d "telegram/" > contacts.json
 # python3 import-telegram-jsonl.py messages -d "telegram/" > messages.jsonl
+# python3 import-telegram-jsonl.py messages -d "telegram/" -j 8 > messages.jsonl
+# python3 import-telegram-jsonl.py all -d "telegram/" -o messages.jsonl -c contacts.json
+# python3 import-telegram-jsonl.py messages -d "telegram/" -s -T /var/tmp > messages.jsonl
+#
+# With -s every file is sorted on its own and spilled to a temporary file, the
+# files are then merged by timestamp.
+#
+# For nightly refreshes of the same export directory keep a manifest, each run
+# then emits only the records appended since the previous one:
+# python3 import-telegram-jsonl.py messages -d "telegram/" -m telegram.manifest.json >> messages.jsonl
 
 import os
 import json
 import argparse
 import sys
+import tempfile
+from contextlib import nullcontext
 from datetime import datetime, timezone
-from collections import OrderedDict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from memento.contacts import ContactCollector
+from memento.manifest import AppendedLines, Manifest
+from memento.extsort import merge_runs, spill_run
+from memento.parallel import encode_messages, encode_sorted_messages, imap_ordered
+from memento.timestamps import DateParser
+from memento.writer import MessageWriter
 
 
 def _safe_id(obj):
@@ -75,6 +94,10 @@ def _display_name(obj):
   return obj.get('id')
 
 
+# common format: 2017-02-01 09:23:03
+WHEN_FORMATS = DateParser("%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S")
+
+
 def _parse_timestamp(record):
   # Try `date` numeric, then `when` strings in nested objects
   d = record.get('date')
@@ -93,140 +116,231 @@ def _parse_timestamp(record):
     s = record.get(side)
     if s and isinstance(s, dict):
       when = s.get('when')
-      if when:
-        # common format: 2017-02-01 09:23:03
-        for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S"):
-          try:
-            dt = datetime.strptime(when, fmt)
-            return dt.replace(tzinfo=timezone.utc).isoformat().replace('+00:00', 'Z')
-          except Exception:
-            pass
+      if when and isinstance(when, str):
+        dt = WHEN_FORMATS.parse(when)
+        if dt is not None:
+          return dt.replace(tzinfo=timezone.utc).isoformat().replace('+00:00', 'Z')
 
   # fallback to current time
   return datetime.now(tz=timezone.utc).isoformat().replace('+00:00', 'Z')
 
 
+def record_contacts(rec, contacts):
+  for side in ('from', 'to'):
+    obj = rec.get(side)
+    uid = _safe_id(obj)
+    if uid and uid not in contacts:
+      contacts.add(uid, uid, 'telegram', _display_name(obj))
+
+
 def collect_contacts(directory, encoding='utf-8'):
-  contacts = {}
+  contacts = ContactCollector()
+
+  for path in list_export_files(directory):
+    with open(path, 'r', encoding=encoding, errors='ignore') as fh:
+      for line in fh:
+        line = line.strip()
+        if not line:
+          continue
+        record_contacts(json.loads(line), contacts)
 
+  return contacts.values()
+
+
+def list_export_files(directory):
   for root, _, files in os.walk(directory):
     for fname in files:
-      if not (fname.endswith('.jsonl') or fname.endswith('.json')):
-        continue
-      path = os.path.join(root, fname)
+      if fname.endswith('.jsonl') or fname.endswith('.json'):
+        yield os.path.join(root, fname)
+
+
+def record_message(rec):
+  # only handle message events
+  if rec.get('event') and rec.get('event') != 'message':
+    return None
+
+  frm = rec.get('from') or {}
+  to = rec.get('to') or {}
+
+  from_id = _safe_id(frm) or ''
+  to_id = _safe_id(to) or ''
+
+  target_type = 'user'
+  if isinstance(to, dict) and to.get('peer_type') and to.get('peer_type') != 'user':
+    target_type = 'group'
+
+  ts = _parse_timestamp(rec)
+
+  text = rec.get('text')
+  # some exports use 'message' key
+  if text is None:
+    text = rec.get('message')
+  if text is None:
+    # no textual payload, try to describe media
+    if rec.get('media'):
+      text = '[media]'
+    else:
+      text = ''
+
+  if target_type == 'user':
+    to = {
+      'type': target_type,
+      'user_id': str(to_id) if target_type == 'user' else None,
+    }
+  else:
+    to = {
+      'type': target_type,
+      'group_id': str(to_id) if target_type == 'group' else None,
+    }
+
+  return {
+    'ts': ts,
+    'platform': 'telegram',
+    'from': str(from_id),
+    'to': to,
+    'text': text,
+  }
+
+
+def parse_lines(lines, on_message, contacts=None):
+  # When a ContactCollector is given the peers of every record are collected
+  # in the same pass
+  for line in lines:
+    line = line.strip()
+    if not line:
+      continue
+    try:
+      rec = json.loads(line)
+    except Exception:
+      continue
+
+    if contacts is not None:
+      record_contacts(rec, contacts)
+    message = record_message(rec)
+    if message is not None:
+      on_message(message)
+
+
+def parse_file(path, on_message, encoding='utf-8', contacts=None, offset=None):
+  # With an offset only the complete lines after it are parsed and the new
+  # offset is returned
+  try:
+    if offset is None:
       with open(path, 'r', encoding=encoding, errors='ignore') as fh:
-        for line in fh:
-          line = line.strip()
-          if not line:
-            continue
-          rec = json.loads(line)
-          for side in ('from', 'to'):
-            obj = rec.get(side)
-            uid = _safe_id(obj)
-            if not uid:
-              continue
-            uname = _display_name(obj)
-            if uid not in contacts:
-              contacts[uid] = OrderedDict({
-                'name': uname,
-                'platforms': [{
-                  'id': uid,
-                  'platform': 'telegram',
-                  'name': uname,
-                  'avatar': '',
-                  'meta': {}
-                }]
-              })
-
-  return list(contacts.values())
-
-
-def collect_messages(directory, on_message, encoding='utf-8'):
-  for root, _, files in os.walk(directory):
-    for fname in files:
-      if not (fname.endswith('.jsonl') or fname.endswith('.json')):
-        continue
-      path = os.path.join(root, fname)
-      try:
-        with open(path, 'r', encoding=encoding, errors='ignore') as fh:
-          for line in fh:
-            line = line.strip()
-            if not line:
-              continue
-            try:
-              rec = json.loads(line)
-            except Exception:
-              continue
-
-            # only handle message events
-            if rec.get('event') and rec.get('event') != 'message':
-              continue
-
-            frm = rec.get('from') or {}
-            to = rec.get('to') or {}
-
-            from_id = _safe_id(frm) or ''
-            to_id = _safe_id(to) or ''
-
-            target_type = 'user'
-            if isinstance(to, dict) and to.get('peer_type') and to.get('peer_type') != 'user':
-              target_type = 'group'
-
-            ts = _parse_timestamp(rec)
-
-            text = rec.get('text')
-            # some exports use 'message' key
-            if text is None:
-              text = rec.get('message')
-            if text is None:
-              # no textual payload, try to describe media
-              if rec.get('media'):
-                text = '[media]'
-              else:
-                text = ''
-
-            if target_type == 'user':
-              to = {
-                'type': target_type,
-                'user_id': str(to_id) if target_type == 'user' else None,
-              }
-            else:
-              to = {
-                'type': target_type,
-                'group_id': str(to_id) if target_type == 'group' else None,
-              }
-
-            message = OrderedDict({
-              'ts': ts,
-              'platform': 'telegram',
-              'from': str(from_id),
-              'to': to,
-              'text': text,
-            })
-
-            on_message(message)
-      except FileNotFoundError:
-        continue
-
-
-def cb_on_message(message):
-  print(json.dumps(message, ensure_ascii=False))
+        parse_lines(fh, on_message, contacts)
+      return None
+    lines = AppendedLines(path, offset, encoding)
+    parse_lines(lines, on_message, contacts)
+    return lines.offset
+  except FileNotFoundError:
+    return offset
+
+
+def pending_files(directory, manifest=None):
+  # Yields (path, offset, stat) for the files to import. Without a manifest
+  # every file is read whole and offset and stat are None.
+  for path in list_export_files(directory):
+    if manifest is None:
+      yield path, None, None
+      continue
+    pending = manifest.pending(path)
+    if pending is not None:
+      yield path, pending[0], pending[1]
+
+
+def collect_messages(directory, on_message, encoding='utf-8', contacts=None, manifest=None):
+  for path, offset, st in pending_files(directory, manifest):
+    end = parse_file(path, on_message, encoding, contacts, offset)
+    if manifest is not None:
+      manifest.update(path, st, end)
+
+
+def _encode_file(task):
+  # Process pool worker: parses a single export file. When sorting, the
+  # sorted lines are spilled to a run file in `spill_dir` and its path is
+  # returned instead.
+  path, offset, encoding, backend, spill_dir, with_contacts = task
+  contacts = ContactCollector() if with_contacts else None
+  end = None
+
+  def collect(on_message):
+    nonlocal end
+    end = parse_file(path, on_message, encoding, contacts, offset)
+
+  if spill_dir is not None:
+    result = spill_run(encode_sorted_messages(collect, backend), spill_dir)
+  else:
+    result = encode_messages(collect, backend)
+  return result, contacts.contacts if with_contacts else None, end
+
+
+def write_messages(directory, writer, encoding='utf-8', jobs=1, sort=False, contacts=None, manifest=None,
+                   temp_dir=None):
+  # Parses the export files in `jobs` processes. Output is written in file
+  # order, or merged by timestamp when `sort` is set, so it does not depend
+  # on the number of jobs. Sorted files are spilled to temporary run files
+  # in `temp_dir` and merged at the end, so memory stays bounded by the
+  # files in flight.
+  spill = tempfile.TemporaryDirectory(prefix='memento-telegram-', dir=temp_dir) if sort else nullcontext()
+  with spill as spill_dir:
+    files = list(pending_files(directory, manifest))
+    tasks = [(path, offset, encoding, writer.backend, spill_dir, contacts is not None) for path, offset, _st in files]
+    runs = []
+    for (path, _offset, st), (result, file_contacts, end) in zip(files, imap_ordered(_encode_file, tasks, jobs)):
+      if contacts is not None:
+        contacts.update(file_contacts)
+      if manifest is not None:
+        manifest.update(path, st, end)
+      if sort:
+        runs.append(result)
+      else:
+        data, count = result
+        writer.write_encoded(data, count)
+    if sort:
+      for _ts, line in merge_runs(runs, spill_dir):
+        writer.write_encoded(line)
 
 
 def main():
   parser = argparse.ArgumentParser(description='Import Telegram jsonl exports')
-  parser.add_argument('command', choices=['contacts', 'messages'])
+  parser.add_argument('command', choices=['contacts', 'messages', 'all'])
   parser.add_argument('-d', '--directory', required=True, help='Base directory containing JSONL exports')
   parser.add_argument('-e', '--encoding', default='utf-8', help='File encoding (default: utf-8)')
+  parser.add_argument('-j', '--jobs', type=int, default=1, help='Parse files in N processes, 0 for one per CPU (default: 1)')
+  parser.add_argument('-s', '--sort', action='store_true', help='Order messages by timestamp instead of by file')
+  parser.add_argument('-T', '--temp-dir', help='Directory for the temporary files of --sort')
+  parser.add_argument('-o', '--output', default='messages.jsonl', help='Messages file for the all command (default: messages.jsonl)')
+  parser.add_argument('-c', '--contacts', default='contacts.json', help='Contacts file for the all command (default: contacts.json)')
+  parser.add_argument('-m', '--manifest', help='Offset manifest file, only records appended since the last run are imported (messages command only)')
 
   args = parser.parse_args()
+  # The all command rewrites the contacts file, which would only keep the
+  # peers of the appended records
+  if args.manifest and args.command != 'messages':
+    parser.error('-m is only supported by the messages command')
 
   if args.command == 'contacts':
     contacts = collect_contacts(args.directory, args.encoding)
     json.dump(contacts, sys.stdout, indent=2, ensure_ascii=False)
   elif args.command == 'messages':
-    collect_messages(args.directory, cb_on_message, args.encoding)
-
+    manifest = Manifest(args.manifest, args.directory) if args.manifest else None
+    with MessageWriter() as writer:
+      if args.jobs == 1 and not args.sort:
+        collect_messages(args.directory, writer.write, args.encoding, manifest=manifest)
+      else:
+        write_messages(args.directory, writer, args.encoding, args.jobs, args.sort, manifest=manifest,
+                       temp_dir=args.temp_dir)
+    if manifest is not None:
+      manifest.save()
+  elif args.command == 'all':
+    contacts = ContactCollector()
+    with MessageWriter(args.output) as writer:
+      if args.jobs == 1 and not args.sort:
+        collect_messages(args.directory, writer.write, args.encoding, contacts)
+      else:
+        write_messages(args.directory, writer, args.encoding, args.jobs, args.sort, contacts,
+                       temp_dir=args.temp_dir)
+    contacts.dump(args.contacts)
 
 if __name__ == '__main__':
   main()
@@ -0,0 +1,55 @@
+# A script to drop duplicate messages from JSONL archives, e.g. after importing
+# overlapping exports or re-running an importer.
+#
+# Messages are identical when platform, from, to, ts and text match. By default
+# every fingerprint is kept in memory; --bloom keeps a fixed size Bloom filter
+# instead, which bounds memory for tens of millions of messages but may drop a
+# unique message with probability --error-rate.
+#
+# Usage:
+# python3 scripts/tools/dedup-messages.py messages.jsonl > messages.dedup.jsonl
+# cat *.jsonl | python3 scripts/tools/dedup-messages.py --bloom -n 50000000 > messages.jsonl
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from memento.dedup import BloomFilter, ExactSet, dedup_lines
+from memento.writer import BUFFER_SIZE, MessageWriter, get_loads
+
+
+def read_lines(files):
+  # Yields (path, line number, line) for every input line
+  if not files:
+    for n, line in enumerate(sys.stdin.buffer, 1):
+      yield '<stdin>', n, line
+    return
+  for path in files:
+    with open(path, 'rb', buffering=BUFFER_SIZE) as f:
+      for n, line in enumerate(f, 1):
+        yield path, n, line
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Drop duplicate messages from JSONL files')
+  parser.add_argument('files', nargs='*', help='Messages JSONL files (default: stdin)')
+  parser.add_argument('-o', '--output', default='-', help='Output file (default: stdout)')
+  parser.add_argument('-b', '--bloom', action='store_true', help='Use a Bloom filter instead of an exact set')
+  parser.add_argument('-n', '--capacity', type=int, default=10000000, help='Expected number of messages for --bloom (default: 10000000)')
+  parser.add_argument('-p', '--error-rate', type=float, default=0.0001, help='False positive rate for --bloom (default: 0.0001)')
+
+  args = parser.parse_args()
+
+  seen = BloomFilter(args.capacity, args.error_rate) if args.bloom else ExactSet()
+  _name, loads = get_loads()
+  with MessageWriter(args.output) as writer:
+    stats = dedup_lines(read_lines(args.files), writer, seen, loads)
+
+  print(f"read {stats.read}, written {stats.written}, dropped {stats.dropped_total} duplicates", file=sys.stderr)
+  for platform, count in sorted(stats.dropped.items()):
+    print(f"  {platform}: {count}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,90 @@
+# A script to build the byte offset sidecar index of a messages.jsonl archive
+# (see memento/offsetindex.py) and to query it.
+#
+# `build` writes messages.jsonl.idx next to the archive unless -o is given.
+# Rebuild the index whenever the archive changes, `query` refuses a stale
+# index. `query` prints the matching lines like a page of /api/messages,
+# reading only those lines from the archive.
+#
+# Usage:
+# python3 scripts/tools/index-messages.py build -j 0 messages.jsonl
+# python3 scripts/tools/index-messages.py query -c alice --cursor 2020-01-01T00:00:00Z -n 100 messages.jsonl
+# python3 scripts/tools/index-messages.py query -g family messages.jsonl
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from memento.offsetindex import KIND_GROUP, KIND_USER, MessageIndex, build_index, index_path
+from memento.timestamps import rfc3339_nanos
+from memento.writer import get_loads
+
+
+def build(args):
+  output = args.output or index_path(args.file)
+  builder = build_index(args.file, output, args.jobs, args.block_size << 10)
+  order = 'sorted' if builder.ordered else 'not sorted by timestamp'
+  print(f"{output}: {builder.messages} messages ({order}), {len(builder.users)} users, "
+        f"{len(builder.groups)} groups, {len(builder.block_ts)} blocks, {os.path.getsize(output)} bytes")
+
+
+def query(args):
+  after = rfc3339_nanos(args.cursor) if args.cursor else None
+  with MessageIndex(args.index or index_path(args.file)) as index:
+    if index.stale(args.file):
+      sys.exit(f"{args.file} changed since it was indexed, run build again")
+
+    with open(args.file, 'rb') as f:
+      out = sys.stdout.buffer
+      if args.contact is not None or args.group is not None:
+        if args.contact is not None:
+          offsets = index.find(KIND_USER, args.contact, after, args.limit)
+        else:
+          offsets = index.find(KIND_GROUP, args.group, after, args.limit)
+        for offset in offsets:
+          f.seek(offset)
+          out.write(f.readline())
+        return
+
+      # No contact: scan from the first block that can hold a later message
+      if after is not None:
+        f.seek(index.seek(after))
+      _name, loads = get_loads()
+      count = 0
+      for line in f:
+        if count >= args.limit:
+          break
+        if after is None or rfc3339_nanos(loads(line)['ts']) > after:
+          out.write(line)
+          count += 1
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Build or query the offset index of a messages JSONL archive')
+  commands = parser.add_subparsers(dest='command', required=True)
+
+  build_parser = commands.add_parser('build', help='Index an archive')
+  build_parser.add_argument('file', help='Messages JSONL file')
+  build_parser.add_argument('-o', '--output', help='Index file (default: FILE.idx)')
+  build_parser.add_argument('-j', '--jobs', type=int, default=0, help='Index in N processes, 0 for one per CPU (default: 0)')
+  build_parser.add_argument('-b', '--block-size', type=int, default=1024,
+                            help='Archive bytes per coarse time table entry in KiB (default: 1024)')
+  build_parser.set_defaults(func=build)
+
+  query_parser = commands.add_parser('query', help='Print a page of messages using the index')
+  query_parser.add_argument('file', help='Messages JSONL file')
+  query_parser.add_argument('-i', '--index', help='Index file (default: FILE.idx)')
+  contact = query_parser.add_mutually_exclusive_group()
+  contact.add_argument('-c', '--contact', help='Messages from or to this user id')
+  contact.add_argument('-g', '--group', help='Messages to this group id')
+  query_parser.add_argument('--cursor', help='Only messages later than this RFC3339 timestamp')
+  query_parser.add_argument('-n', '--limit', type=int, default=100, help='Messages per page (default: 100)')
+  query_parser.set_defaults(func=query)
+
+  args = parser.parse_args()
+  args.func(args)
+
+
+if __name__ == '__main__':
+  main()
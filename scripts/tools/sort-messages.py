@@ -0,0 +1,36 @@
+# A script to merge any number of importer outputs into a single messages.jsonl
+# ordered by timestamp, as expected by the cursor pagination of `memento serve`.
+#
+# Inputs larger than memory are sorted in runs of at most --buffer-size MiB that
+# are spilled to temporary files and merged afterwards. Messages with equal
+# timestamps keep their input order.
+#
+# Usage:
+# python3 scripts/tools/sort-messages.py telegram.jsonl skype.jsonl icq.jsonl > messages.jsonl
+# python3 scripts/tools/sort-messages.py -S 1024 -T /var/tmp -o messages.jsonl data/*.jsonl
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from memento.extsort import sort_messages
+from memento.writer import MessageWriter
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Sort messages JSONL files by timestamp')
+  parser.add_argument('files', nargs='+', help='Messages JSONL files')
+  parser.add_argument('-o', '--output', default='-', help='Output file (default: stdout)')
+  parser.add_argument('-S', '--buffer-size', type=int, default=256, help='Size of in-memory runs in MiB (default: 256)')
+  parser.add_argument('-T', '--temp-dir', help='Directory for temporary run files')
+
+  args = parser.parse_args()
+
+  with MessageWriter(args.output) as writer:
+    runs = sort_messages(args.files, writer, args.buffer_size << 20, args.temp_dir)
+  print(f"sorted {writer.count} messages using {runs} temporary runs", file=sys.stderr)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,61 @@
+# A script to check JSONL archives against the ty.Message schema before they
+# are served, e.g. to gate an archive rebuild after changing an importer.
+#
+# Every line must be a JSON object with an RFC3339 `ts`, a string `platform`,
+# `from`, a user or group `to` target and `text`, and no fields ty.Message
+# does not have. Errors are listed with file, line number and byte offset,
+# followed by counts per error class. The exit status is 1 if any line is
+# invalid.
+#
+# Unknown fields are ignored by the server and only reported as warnings,
+# --strict makes them errors.
+#
+# Usage:
+# python3 scripts/tools/validate-messages.py messages.jsonl
+# python3 scripts/tools/validate-messages.py -j 0 -m 3 data/*.jsonl
+# python3 scripts/tools/validate-messages.py --strict messages.jsonl
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from memento.chunked import map_chunks
+from memento.schema import ValidationResult, validate_chunk
+
+
+def validate_file(path, jobs=1, max_examples=10, strict=False):
+  result = ValidationResult(max_examples)
+  for chunk_result in map_chunks(path, validate_chunk, jobs, args=(max_examples, strict)):
+    result.merge(chunk_result)
+  return result
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Validate messages JSONL files against ty.Message')
+  parser.add_argument('files', nargs='+', help='Messages JSONL files')
+  parser.add_argument('-j', '--jobs', type=int, default=0, help='Validate in N processes, 0 for one per CPU (default: 0)')
+  parser.add_argument('-m', '--max-examples', type=int, default=10, help='Errors listed per error class and file (default: 10)')
+  parser.add_argument('--strict', action='store_true', help='Treat fields unknown to ty.Message as errors')
+
+  args = parser.parse_args()
+
+  failed = False
+  for path in args.files:
+    result = validate_file(path, args.jobs, args.max_examples, args.strict)
+    for line_number, offset, error_class, detail, severity in sorted(result.examples):
+      prefix = 'warning: ' if severity == 'warning' else ''
+      print(f"{path}:{line_number}: {prefix}[{error_class}] {detail} (offset {offset})")
+    status = 'ok' if not result.invalid else f"{result.invalid} invalid"
+    print(f"{path}: {result.lines} lines, {status}")
+    for error_class, count in sorted(result.counts.items()):
+      print(f"  {error_class}: {count}")
+    for error_class, count in sorted(result.warnings.items()):
+      print(f"  {error_class}: {count} (warning)")
+    failed = failed or result.invalid > 0
+
+  sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+  main()
@@ -20,14 +20,27 @@
 # Usage:
 # python3 import-trillian-logs.py contacts -d "TrillianLogs/" > contacts.json
 # python3 import-trillian-logs.py messages -d "TrillianLogs/" > messages.jsonl
+# python3 import-trillian-logs.py all -d "TrillianLogs/" -o messages.jsonl -c contacts.json
+# python3 import-trillian-logs.py messages -d "TrillianLogs/" -j 8 > messages.jsonl
+#
+# Log files that fail to parse are reported on stderr and the rest of them is
+# skipped, messages before the error are kept. The exit status is 1 if there
+# were any.
 
+import io
+import mmap
 import os
 import json
 import argparse
 import sys
-from datetime import datetime, timedelta
+from datetime import timedelta
 import re
-from collections import OrderedDict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from memento.contacts import ContactCollector
+from memento.parallel import imap_ordered
+from memento.timestamps import DateParser
+from memento.writer import MessageWriter
 
 # Map directory names to platforms
 PLATFORM_MAP = {
@@ -37,12 +50,30 @@ PLATFORM_MAP = {
     "YAHOO": "yahoo"
 }
 
+SESSION_START_RE = re.compile(r"Session Start \((\w+) - ([^:]+):(.+?)\): (.+)")
+MESSAGE_RE = re.compile(r"^(.+?): (.*)$")
+# A line that ends any session, see parse_log. A lone \r ends a line too, so
+# it may not appear within the match.
+SESSION_CLOSE_LINE_RE = re.compile(rb"^[ \t\f\v]*Session Close[^\r\n]*\r?\n", re.M)
+
+# Log files larger than this are parsed in ranges of about this size by -j
+CHUNK_SIZE = 1 << 20
+
+DATE_FORMAT = "%a %b %d %H:%M:%S %Y"
+DATES = DateParser(DATE_FORMAT)
+
+def parse_date(date_str):
+    dt = DATES.parse(date_str.strip())
+    if dt is None:
+        raise ValueError(f"time data {date_str.strip()!r} does not match format {DATE_FORMAT!r}")
+    return dt
+
 def parse_session_start(line):
     # Session Start (ICQ - 000001:Alice): Thu Jan 24 21:54:39 2002
-    match = re.match(r"Session Start \((\w+) - ([^:]+):(.+?)\): (.+)", line)
+    match = SESSION_START_RE.match(line)
     if match:
         platform_type, user_id, name, date_str = match.groups()
-        dt = datetime.strptime(date_str.strip(), "%a %b %d %H:%M:%S %Y")
+        dt = parse_date(date_str)
         return {
             "platform": PLATFORM_MAP.get(platform_type, platform_type.lower()),
             "user_id": user_id,
@@ -51,31 +82,21 @@ def parse_session_start(line):
         }
     return None
 
-def parse_session_close(line):
-    # Session Close (Alice): Thu Jan 24 23:05:59 2002
-    match = re.match(r"Session Close \((.+?)\): (.+)", line)
-    if match:
-        name, date_str = match.groups()
-        dt = datetime.strptime(date_str.strip(), "%a %b %d %H:%M:%S %Y")
-        return {
-            "name": name.strip(),
-            "timestamp": dt
-        }
-    return None
+def collect_contacts(directory, encoding='utf-8'):
+    contacts = ContactCollector()
+    for filepath, platform, contact_id in list_log_files(directory):
+        with open(filepath, 'r', encoding=encoding, errors='ignore') as f:
+            # find first Session Start line to get contact display name and account owner UIN
+            for l in f:
+                session_info = parse_session_start(l.strip())
+                if session_info:
+                    contacts.add(f"{platform}_{contact_id}", str(contact_id), platform, session_info['name'])
+                    break
 
-def parse_message_line(line):
-    # "Alice: Hi Bob"
-    match = re.match(r"^(.+?): (.*)$", line)
-    if match:
-        sender, text = match.groups()
-        return {
-            "sender": sender,
-            "text": text
-        }
-    return None
+    return contacts.values()
 
-def collect_contacts(directory, encoding='utf-8'):
-    contacts = {}
+def list_log_files(directory):
+    # Yields (path, platform, contact id) for every log file
     for platform_dir, platform in PLATFORM_MAP.items():
         platform_path = os.path.join(directory, platform_dir)
         if not os.path.isdir(platform_path):
@@ -83,134 +104,183 @@ def collect_contacts(directory, encoding='utf-8'):
         query_subpath = os.path.join(platform_path, 'Query')
         if os.path.isdir(query_subpath):
             platform_path = query_subpath
+
         for filename in os.listdir(platform_path):
             if filename.endswith('.log'):
-                filepath = os.path.join(platform_path, filename)
                 # filename (without .log) is the contact UIN
-                contact_id = filename[:-4]
-                with open(filepath, 'r', encoding=encoding, errors='ignore') as f:
-                    # find first Session Start line to get contact display name and account owner UIN
-                    for l in f:
-                        session_info = parse_session_start(l.strip())
-                        if session_info:
-                            contact_name = session_info['name']
-
-                            contact_key = f"{platform}_{contact_id}"
-                            if contact_key not in contacts:
-                                contacts[contact_key] = OrderedDict({
-                                    "name": contact_name,
-                                    "platforms": [{
-                                        "id": str(contact_id),
-                                        "platform": platform,
-                                        "name": contact_name,
-                                        "avatar": "",
-                                        "meta": {}
-                                    }]
-                                })
-                            break
-
-    return list(contacts.values())
-
-def collect_messages(directory, on_message, encoding='utf-8'):
-    for platform_dir, platform in PLATFORM_MAP.items():
-        platform_path = os.path.join(directory, platform_dir)
-        if not os.path.isdir(platform_path):
+                yield os.path.join(platform_path, filename), platform, filename[:-4]
+
+def parse_log(lines, platform, contact_id, contacts=None):
+    # Line streaming state machine, every line is matched once. Outside of a
+    # session only a Session Start line is looked for. Inside a session a
+    # "sender: text" line starts a new message, other non-empty lines are
+    # continuations of the pending one, and a Session Close or Start line ends
+    # the session (that Session Start line does not open a new session).
+    session = None
+    pending = None
+    msg_index = 0
+
+    def emit():
+        nonlocal msg_index
+        sender, text = pending
+        # Calculate timestamp (5 second intervals)
+        msg_time = session['timestamp'] + timedelta(seconds=msg_index * 5)
+        msg_index += 1
+
+        # session['user_id'] is the account owner's UIN
+        if sender == session['name']:
+            # Message from contact
+            from_id = contact_id
+            to_id = session['user_id']
+        else:
+            # Message from account owner
+            from_id = session['user_id']
+            to_id = contact_id
+
+        return {
+            "ts": msg_time.isoformat() + "Z",
+            "platform": platform,
+            "from": str(from_id),
+            "to": {
+                "type": "user",
+                "user_id": str(to_id)
+            },
+            "text": text,
+        }
+
+    for line in lines:
+        line = line.strip()
+        if session is None:
+            if line.startswith("Session Start"):
+                session = parse_session_start(line)
+                if session is not None:
+                    msg_index = 0
+                    if contacts is not None:
+                        contacts.add(f"{platform}_{contact_id}", str(contact_id), platform, session['name'])
             continue
-        query_subpath = os.path.join(platform_path, 'Query')
-        if os.path.isdir(query_subpath):
-            platform_path = query_subpath
 
-        for filename in os.listdir(platform_path):
-            if filename.endswith('.log'):
-                filepath = os.path.join(platform_path, filename)
-                # filename (without .log) is the contact UIN
-                contact_id = filename[:-4]
-
-                with open(filepath, 'r', encoding=encoding, errors='ignore') as f:
-                    lines = f.readlines()
-
-                i = 0
-                while i < len(lines):
-                    line = lines[i].strip()
-                    session_info = parse_session_start(line)
-                    if session_info:
-                        session_start_time = session_info['timestamp']
-                        # session_info['user_id'] is the account owner's UIN
-                        account_owner_id = session_info['user_id']
-                        contact_name = session_info['name']
-
-                        # Parse messages until session close
-                        i += 1
-                        msg_index = 0
-                        while i < len(lines):
-                            line = lines[i].strip()
-
-                            # Check for session close or next session start
-                            if line.startswith("Session Close") or line.startswith("Session Start"):
-                                i += 1
-                                break
-
-                            # Parse message line (format: "sender: text")
-                            msg_info = parse_message_line(line)
-                            if msg_info:
-                                sender = msg_info['sender']
-                                text = msg_info['text']
-
-                                # Collect continuation lines for this message
-                                i += 1
-                                while i < len(lines):
-                                    next_line = lines[i].strip()
-
-                                    # Stop if we hit session marker or next message
-                                    if (next_line.startswith("Session Close") or
-                                        next_line.startswith("Session Start") or
-                                        parse_message_line(next_line)):
-                                        break
-
-                                    # Add continuation line to message text
-                                    if next_line:
-                                        text += "\n" + next_line
-                                    i += 1
-
-                                # Calculate timestamp (5 second intervals)
-                                msg_time = session_start_time + timedelta(seconds=msg_index * 5)
-
-                                # Determine from/to based on sender
-                                if sender == contact_name:
-                                    # Message from contact
-                                    from_id = contact_id
-                                    to_id = account_owner_id
-                                else:
-                                    # Message from account owner
-                                    from_id = account_owner_id
-                                    to_id = contact_id
-
-                                message = OrderedDict({
-                                    "ts": msg_time.isoformat() + "Z",
-                                    "platform": platform,
-                                    "from": str(from_id),
-                                    "to": {
-                                        "type": "user",
-                                        "user_id": str(to_id)
-                                    },
-                                    "text": text,
-                                })
-
-                                on_message(message)
-                                msg_index += 1
-                            else:
-                                i += 1
-                    else:
-                        i += 1
-
-def cb_on_message(message):
-    print(json.dumps(message, ensure_ascii=False))
+        if line.startswith("Session Close") or line.startswith("Session Start"):
+            if pending is not None:
+                yield emit()
+                pending = None
+            session = None
+            continue
+
+        match = MESSAGE_RE.match(line)
+        if match:
+            if pending is not None:
+                yield emit()
+            pending = list(match.groups())
+        elif pending is not None and line:
+            pending[1] += "\n" + line
+
+    if pending is not None:
+        yield emit()
+
+def read_log(filepath, encoding='utf-8', start=0, end=None):
+    # Yields the lines of a log file, or of its byte range start:end
+    if end is None and start == 0:
+        with open(filepath, 'r', encoding=encoding, errors='ignore') as f:
+            yield from f
+        return
+    with open(filepath, 'rb') as f:
+        f.seek(start)
+        data = f.read() if end is None else f.read(end - start)
+    yield from io.TextIOWrapper(io.BytesIO(data), encoding=encoding, errors='ignore')
+
+def split_log(filepath, encoding='utf-8', chunk_size=CHUNK_SIZE):
+    # Returns (start, end) byte ranges of a log file, end is None for the
+    # last one. Every range but the last ends with a Session Close line, so
+    # parsing starts outside of a session in every range and the ranges parse
+    # to the same messages as the whole file. Only files in encodings that
+    # keep ASCII bytes as they are can be split.
+    size = os.path.getsize(filepath)
+    try:
+        ascii_compatible = 'Session Close\n'.encode(encoding) == b'Session Close\n'
+    except LookupError:
+        ascii_compatible = False
+    if size <= chunk_size or not ascii_compatible:
+        return [(0, None)]
+    ranges = []
+    start = 0
+    with open(filepath, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        while size - start > chunk_size:
+            match = SESSION_CLOSE_LINE_RE.search(m, start + chunk_size)
+            if match is None:
+                break
+            ranges.append((start, match.end()))
+            start = match.end()
+    ranges.append((start, None))
+    return ranges
+
+def collect_log(lines, platform, contact_id, on_message, contacts=None):
+    # Passes the messages of a log to on_message and returns the error that
+    # stopped parsing, None if there was none. Messages before the error are
+    # passed on, errors raised by on_message are not caught.
+    messages = parse_log(lines, platform, contact_id, contacts)
+    while True:
+        try:
+            message = next(messages)
+        except StopIteration:
+            return None
+        except Exception as e:
+            return f"{type(e).__name__}: {e}"
+        on_message(message)
+
+def collect_messages(directory, on_message, encoding='utf-8', contacts=None):
+    # When a ContactCollector is given the contact of every log file is
+    # collected from its first session in the same pass. Log files that fail
+    # to parse are reported on stderr and the rest of them is skipped, their
+    # paths are returned.
+    failed = []
+    for filepath, platform, contact_id in list_log_files(directory):
+        error = collect_log(read_log(filepath, encoding), platform, contact_id, on_message, contacts)
+        if error is not None:
+            print(f"Failed to import {filepath}: {error}", file=sys.stderr)
+            failed.append(filepath)
+    return failed
+
+def _encode_log(task):
+    # Process pool worker: parses a byte range of a log file. Returns the
+    # messages encoded up to the first error along with the error, so that
+    # the output is the same as with collect_messages.
+    filepath, start, end, platform, contact_id, encoding, backend, with_contacts = task
+    contacts = ContactCollector() if with_contacts else None
+    buf = io.BytesIO()
+    writer = MessageWriter(buf, backend=backend)
+    error = collect_log(read_log(filepath, encoding, start, end), platform, contact_id, writer.write, contacts)
+    writer.flush()
+    return buf.getvalue(), writer.count, contacts.contacts if with_contacts else None, error
+
+def write_messages(directory, writer, encoding='utf-8', jobs=1, contacts=None):
+    # Parses the log files in `jobs` processes and writes them in directory
+    # order. Large files are split into ranges of whole sessions so a worker
+    # never holds more than about CHUNK_SIZE of a file's output. Failed files
+    # are handled like in collect_messages.
+    tasks = [(filepath, start, end, platform, contact_id, encoding, writer.backend, contacts is not None)
+             for filepath, platform, contact_id in list_log_files(directory)
+             for start, end in split_log(filepath, encoding)]
+    failed = []
+    for task, (data, count, file_contacts, error) in zip(tasks, imap_ordered(_encode_log, tasks, jobs)):
+        filepath = task[0]
+        if failed and failed[-1] == filepath:
+            continue
+        if contacts is not None:
+            contacts.update(file_contacts)
+        writer.write_encoded(data, count)
+        if error is not None:
+            print(f"Failed to import {filepath}: {error}", file=sys.stderr)
+            failed.append(filepath)
+    return failed
 
 def main():
     parser = argparse.ArgumentParser(description="Import Trillian logs")
-    parser.add_argument('command', choices=['contacts', 'messages'])
+    parser.add_argument('command', choices=['contacts', 'messages', 'all'])
     parser.add_argument('-d', '--directory', required=True, help='Base directory containing Trillian logs')
     parser.add_argument('-e', '--encoding', default='utf-8', help='File encoding (default: utf-8)')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Parse log files in N processes, 0 for one per CPU (default: 1)')
+    parser.add_argument('-o', '--output', default='messages.jsonl', help='Messages file for the all command (default: messages.jsonl)')
+    parser.add_argument('-c', '--contacts', default='contacts.json', help='Contacts file for the all command (default: contacts.json)')
 
     args = parser.parse_args()
 
@@ -218,7 +288,23 @@ def main():
         contacts = collect_contacts(args.directory, args.encoding)
         json.dump(contacts, sys.stdout, indent=2, ensure_ascii=False)
     elif args.command == 'messages':
-        collect_messages(args.directory, cb_on_message, args.encoding)
+        with MessageWriter() as writer:
+            if args.jobs == 1:
+                failed = collect_messages(args.directory, writer.write, args.encoding)
+            else:
+                failed = write_messages(args.directory, writer, args.encoding, args.jobs)
+        if failed:
+            sys.exit(1)
+    elif args.command == 'all':
+        contacts = ContactCollector()
+        with MessageWriter(args.output) as writer:
+            if args.jobs == 1:
+                failed = collect_messages(args.directory, writer.write, args.encoding, contacts)
+            else:
+                failed = write_messages(args.directory, writer, args.encoding, args.jobs, contacts)
+        contacts.dump(args.contacts)
+        if failed:
+            sys.exit(1)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file